@@ -7,9 +7,17 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
-import scipy.sparse as sp
-from scipy.sparse.linalg import factorized
-from PIL import Image
+from laplacian_coordinates import (
+    grid_laplacian,
+    LaplacianCoordinatesSession,
+    solve_volume,
+    solve_superpixels,
+    solve_labels,
+    propagate_volume,
+    pyamg,
+)
+from segmentacion import voxel_desde_pantalla
+from trazos import Trazos
 
 customtkinter.set_appearance_mode("Dark")
 customtkinter.set_default_color_theme("green")
@@ -25,7 +33,9 @@ class GUI(customtkinter.CTk):
         self.grid_columnconfigure((2, 3), weight=0)
         self.grid_rowconfigure((0, 1), weight=1)
 
-        self.coordenadas = []
+        self.trazos = None
+        self.lc_session = None
+        self.lc_session_method = None
 
         self.file_path = None
         self.file_shape = None
@@ -169,7 +179,7 @@ class GUI(customtkinter.CTk):
         self.brush_size_slider.set(3)
         self.brush_size_slider.grid(row=9, column=0, padx=20, pady=10)
         self.clear_draws_button = customtkinter.CTkButton(
-            self.sidebar_frame, text="Limpiar dibujos", command=self.limpiar_dibujo
+            self.sidebar_frame, text="Limpiar dibujos", command=self.limpiar_semillas
         )
         self.clear_draws_button.grid(row=10, column=0, padx=20, pady=(10, 20))
 
@@ -183,6 +193,50 @@ class GUI(customtkinter.CTk):
         )
         self.save_file_button.grid(row=12, column=0, padx=20, pady=(10, 20))
 
+        self.solver_methods = {
+            "Solver automático": "auto",
+            "Directo": "direct",
+            "CG + multigrilla": "multigrid",
+            "CG + AMG": "amg",
+            "Superpíxeles": "superpixels",
+        }
+        # Sin pyamg la opción AMG no existe; "auto" usa la multigrilla en
+        # cortes grandes, que no la necesita.
+        if pyamg is None:
+            del self.solver_methods["CG + AMG"]
+        self.solver_select = customtkinter.CTkOptionMenu(
+            self.sidebar_frame, values=list(self.solver_methods)
+        )
+        self.solver_select.grid(row=13, column=0, padx=20, pady=10)
+
+        self.export_button = customtkinter.CTkButton(
+            self.sidebar_frame, text="Exportar corte", command=self.exportar_corte
+        )
+        self.export_button.grid(row=14, column=0, padx=20, pady=(10, 20))
+
+        self.procesar_volumen_button = customtkinter.CTkButton(
+            self.sidebar_frame, text="Procesar volumen", command=self.procesar_volumen
+        )
+        self.procesar_volumen_button.grid(row=15, column=0, padx=20, pady=(10, 20))
+
+        self.color_select = customtkinter.CTkOptionMenu(
+            self.sidebar_frame,
+            values=self.colors[1],
+            command=self.update_color,
+        )
+        self.color_select.grid(row=16, column=0, padx=20, pady=10)
+
+        self.procesar_etiquetas_button = customtkinter.CTkButton(
+            self.sidebar_frame,
+            text="Procesar etiquetas",
+            command=self.procesar_etiquetas,
+        )
+
+        self.propagar_button = customtkinter.CTkButton(
+            self.sidebar_frame, text="Propagar cortes", command=self.propagar_cortes
+        )
+        self.propagar_button.grid(row=18, column=0, padx=20, pady=(10, 20))
+
         self.update_dimension()
 
     def update_dimension(self, *args):
@@ -225,8 +279,18 @@ class GUI(customtkinter.CTk):
             self.ax = self.fig.add_subplot(111)
             self.canvas = FigureCanvasTkAgg(self.fig, master=self)
             self.canvas.get_tk_widget().grid(row=0, column=1, rowspan=6, sticky="nsew")
+            # Los manejadores se conectan una sola vez, no en cada cambio de
+            # capa.
+            self.fig.canvas.mpl_connect("button_press_event", self.on_click)
+            self.fig.canvas.mpl_connect("motion_notify_event", self.on_drag)
+            self.fig.canvas.mpl_connect("button_release_event", self.on_release)
 
         self.ax.clear()
+        if self.trazos is None:
+            self.trazos = Trazos(self.ax)
+        else:
+            self.trazos.adjuntar(self.ax)
+        self.trazos.corte = (self.dimension, self.layer)
 
         self.ax.imshow(slice_data, cmap="gray")
         self.ax.set_xlabel("X")
@@ -236,61 +300,73 @@ class GUI(customtkinter.CTk):
         if self.moving_image:
             self.ax.title.set_text("Fixed")
 
-        self.fig.canvas.mpl_connect("button_press_event", self.on_click)
-        self.fig.canvas.mpl_connect("motion_notify_event", self.on_drag)
-        self.fig.canvas.mpl_connect("button_release_event", self.on_release)
         self.canvas.draw()
 
+    def update_color(self, *args):
+        self.current_color = self.colors[0][
+            self.colors[1].index(self.color_select.get())
+        ]
+
     def update_brush_size(self, *args):
         self.brush_size = int(self.brush_size_slider.get())
         self.brush_size_label.configure(text=f"Tamaño del pincel: {self.brush_size}")
 
     def dibujar(self, event):
         if event.inaxes == self.ax:
-            x = int(round(event.xdata))
-            y = int(round(event.ydata))
+            x, y = self.posicion_trazo(event)
             if event.button == 1:  # Click izquierdo
                 color = "g"  # Verde
             elif event.button == 3:  # Click derecho
                 color = "r"  # Rojo
             else:
                 return
-            self.coordenadas.append((x, y, color))
-            for coord in self.coordenadas:
-                self.ax.plot(
-                    coord[0], coord[1], marker="o", markersize=5, color=coord[2]
-                )
-            self.fig.canvas.draw()
+            self.trazos.agregar(y, x, color, corte=(self.dimension, self.layer))
+            self.trazos.dibujar()
+
+    def color_trazo(self, button):
+        # Izquierdo y derecho son fondo y objeto; el central pinta con el
+        # color del pincel y agrega etiquetas para la segmentación múltiple.
+        if button == 1:
+            return "g"
+        if button == 2:
+            return self.current_color
+        return "r"
 
     def on_click(self, event):
         if event.inaxes == self.ax:
-            x = int(round(event.xdata))
-            y = int(round(event.ydata))
-            color = "g" if event.button == 1 else "r"
-            self.coordenadas.append((y, x, color))
-            self.ax.plot(x, y, marker="o", markersize=5, color=color)
-            self.fig.canvas.draw()
+            self.agregar_trazo(event)
 
     def on_drag(self, event):
-        if event.inaxes == self.ax and event.button == 1:
-            x = int(round(event.xdata))
-            y = int(round(event.ydata))
-            color = "g" if event.button == 1 else "r"
-            self.coordenadas.append((y, x, color))
-            self.ax.plot(x, y, marker="o", markersize=5, color=color)
-            self.fig.canvas.draw()
+        if event.inaxes == self.ax and event.button in (1, 2):
+            self.agregar_trazo(event)
+
+    def posicion_trazo(self, event):
+        # Al redondear, un clic en el borde puede caer justo fuera del corte.
+        h, w = self.image.shape
+        x = min(max(int(round(event.xdata)), 0), w - 1)
+        y = min(max(int(round(event.ydata)), 0), h - 1)
+        return x, y
+
+    def agregar_trazo(self, event):
+        x, y = self.posicion_trazo(event)
+        color = self.color_trazo(event.button)
+        indice = np.ravel_multi_index(
+            voxel_desde_pantalla(x, y, self.dimension, self.layer, self.file_shape),
+            self.file_shape,
+        )
+        self.trazos.agregar(y, x, color, indice, (self.dimension, self.layer))
+        self.trazos.dibujar()
 
     def on_release(self, event):
-        if event.inaxes == self.ax:
-            self.fig.canvas.draw()
+        pass
 
     def limpiar_dibujo(self):
-        self.coordenadas = []
+        self.trazos.limpiar()
 
-        for line in self.ax.lines:
-            line.remove()
-
-        self.fig.canvas.draw()
+    def limpiar_semillas(self):
+        if self.lc_session is not None:
+            self.lc_session.clear_seeds()
+        self.limpiar_dibujo()
 
     def restore_file(self):
         self.modified_data = self.data
@@ -303,82 +379,51 @@ class GUI(customtkinter.CTk):
 
     def establecer(self):
         self.procesar_button.grid(row=6, column=0, padx=20, pady=(10, 20))
+        self.procesar_etiquetas_button.grid(row=17, column=0, padx=20, pady=(10, 20))
         self.layer_slider.configure(state="disabled")
         self.dimension_select.configure(state="disabled")
         self.establecer_button.destroy()
+        self.lc_session = None
 
-        if self.image is not None:
-            matplotlib.pyplot.imsave("current_image.png", self.image, cmap="gray")
-
-        ruta_imagen = "current_image.png"
-        self.imagen = Image.open(ruta_imagen).convert("L")
-        self.imagen = np.array(self.imagen)
+        # El corte se usa directamente en memoria, sin pasar por un PNG de 8
+        # bits; la exportación queda como acción explícita.
+        self.imagen = np.ascontiguousarray(self.image, dtype=np.float32)
 
         self.ax.imshow(self.imagen)
         self.ax.set_axis_off()
         self.fig.canvas.draw()
 
+    def exportar_corte(self):
+        if self.imagen is not None:
+            matplotlib.pyplot.imsave("current_image.png", self.imagen, cmap="gray")
+
     def procesar(self):
-        if not self.coordenadas:
+        filas, columnas, codigos = self.trazos.semillas()
+        if not len(filas):
             return
         print("Procesando...")
-        # print(self.coordenadas)
+        fondo = codigos == self.trazos.codigo("g")
 
         h, w = self.imagen.shape
 
-        def laplacian_coordinates_weights(img, epsilon=10e-6):
-            weights = sp.lil_matrix((h * w, h * w))
-
-            sigma = np.max(np.abs(np.diff(self.imagen.flatten())))
-            print("Sigma: ", sigma)
-
-            for i in range(h):
-                for j in range(w):
-                    idx = i * w + j
-                    if i > 0:
-                        weights[idx, (i - 1) * w + j] = np.exp(
-                            -epsilon * ((img[i, j] - img[i - 1, j]) ** 2).sum() / sigma
-                        )
-                    if i < h - 1:
-                        weights[idx, (i + 1) * w + j] = np.exp(
-                            -epsilon * ((img[i, j] - img[i + 1, j]) ** 2).sum() / sigma
-                        )
-                    if j > 0:
-                        weights[idx, i * w + j - 1] = np.exp(
-                            -epsilon * ((img[i, j] - img[i, j - 1]) ** 2).sum() / sigma
-                        )
-                    if j < w - 1:
-                        weights[idx, i * w + j + 1] = np.exp(
-                            -epsilon * ((img[i, j] - img[i, j + 1]) ** 2).sum() / sigma
-                        )
-
-            return weights
-
-        weights = laplacian_coordinates_weights(self.imagen)
-        print("Tamaño matrix de pesos: ", weights.shape)
-
-        # plt.imshow(weights, cmap='gray')
-        # plt.colorbar()
-        # plt.show()
-
-        def laplacian_coordinates_matrix(weights):
-            D = sp.diags(weights.sum(axis=1).A.ravel())
-            return D - weights
-
-        L = laplacian_coordinates_matrix(weights)
-        print("Tamaño matrix de Laplacian: ", L.shape)
+        method = self.solver_methods[self.solver_select.get()]
+        if method != "superpixels" and (
+            self.lc_session is None or self.lc_session_method != method
+        ):
+            L = grid_laplacian(self.imagen)
+            print("Tamaño matrix de Laplacian: ", L.shape)
+
+            self.lc_session = LaplacianCoordinatesSession(L, method, shape=(h, w))
+            self.lc_session_method = method
 
         xB = 0
         xF = 0
 
-        for i, j, color in self.coordenadas:
-            if color == "g":
-                xB += self.imagen[i, j]
-            else:
-                xF += self.imagen[i, j]
+        xB += self.imagen[filas[fondo], columnas[fondo]].sum()
+        xF += self.imagen[filas[~fondo], columnas[~fondo]].sum()
 
-        # xB = xB / len([c for c in self.coordenadas if c[2] == 'g'])
-        # xF = xF / len([c for c in self.coordenadas if c[2] == 'r'])
+        # xB = xB / np.count_nonzero(fondo)
+        # xF = xF / np.count_nonzero(~fondo)
 
         xB = -1
         xF = 1
@@ -386,22 +431,16 @@ class GUI(customtkinter.CTk):
         print("xB: ", xB)
         print("xF: ", xF)
 
-        Is = sp.lil_matrix((h * w, h * w))
-        L_2 = L.dot(L)
-        b = np.zeros(h * w)
-
-        indices = np.array([[i * w + j for j in range(w)] for i in range(h)])
-        for i, j, color in self.coordenadas:
-            index = indices[i, j]
-            Is[index, index] = 1
-            b[index] = xB if color == "g" else xF
-            # print(i, j, color)
+        seeds = filas * w + columnas
+        seed_values = np.where(fondo, xB, xF)
 
-        print("Tamaño matrix de Is: ", Is.shape)
-
-        A = sp.csr_matrix(Is + L_2)
-        solve = factorized(A)
-        x = solve(b)
+        if method == "superpixels":
+            x = solve_superpixels(self.imagen, seeds, seed_values)
+        else:
+            # Las semillas se acumulan en la sesión: volver a procesar después
+            # de agregar trazos reutiliza el operador y la solución anterior.
+            self.lc_session.add_seeds(seeds, seed_values)
+            x = self.lc_session.solve()
 
         segmented_image = x.reshape((h, w))
 
@@ -413,6 +452,110 @@ class GUI(customtkinter.CTk):
         self.limpiar_dibujo()
         self.fig.canvas.draw()
 
+    def procesar_etiquetas(self):
+        # Cada color pintado es una etiqueta; todas se resuelven con el mismo
+        # operador y se asigna la de mayor respuesta en cada píxel.
+        filas, columnas, codigos = self.trazos.semillas()
+        paleta = [matplotlib.colors.to_hex(color) for color in self.trazos.paleta]
+        etiquetas = list(dict.fromkeys(paleta[c] for c in np.unique(codigos)))
+        if len(etiquetas) < 2:
+            tkinter.messagebox.showerror(
+                "Error", "Se necesitan semillas de al menos dos colores."
+            )
+            return
+        print("Procesando etiquetas...")
+
+        h, w = self.imagen.shape
+
+        method = self.solver_methods[self.solver_select.get()]
+        if method == "superpixels":
+            method = "auto"
+        L = grid_laplacian(self.imagen)
+
+        seeds = filas * w + columnas
+        seed_labels = np.array([etiquetas.index(color) for color in paleta])[codigos]
+
+        labels, X = solve_labels(
+            L, seeds, seed_labels, len(etiquetas), method, shape=(h, w)
+        )
+
+        paleta = np.array([matplotlib.colors.to_rgb(color) for color in etiquetas])
+        self.ax.imshow(paleta[labels.reshape((h, w))])
+        self.limpiar_dibujo()
+        self.fig.canvas.draw()
+
+    def propagar_cortes(self):
+        # Las semillas del corte actual segmentan ese corte; el resultado,
+        # erosionado, siembra los cortes vecinos en ambos sentidos. Sólo
+        # cuentan las semillas pintadas en el corte en pantalla: las de otras
+        # capas o dimensiones no corresponden a self.layer.
+        self.trazos.corte = (self.dimension, self.layer)
+        filas, columnas, codigos = self.trazos.semillas()
+        fondo = codigos == self.trazos.codigo("g")
+        if fondo.all() or not fondo.any():
+            tkinter.messagebox.showerror(
+                "Error",
+                "Se necesitan semillas con ambos botones del mouse en este corte.",
+            )
+            return
+        print("Propagando cortes...")
+
+        # Se propaga desde el corte en pantalla; no hace falta establecerlo.
+        h, w = self.image.shape
+
+        xB = -1
+        xF = 1
+
+        seeds = filas * w + columnas
+        seed_values = np.where(fondo, xB, xF)
+
+        # Los cortes se muestran rotados: se propaga sobre la pila rotada para
+        # que los índices de las semillas coincidan con los de la pantalla.
+        stack = np.rot90(
+            np.moveaxis(self.modified_data, self.dimension, 0), axes=(1, 2)
+        )
+        method = self.solver_methods[self.solver_select.get()]
+        if method == "superpixels":
+            method = "auto"
+        masks = propagate_volume(
+            stack, {self.layer: (seeds, seed_values)}, method=method
+        )
+        mask = np.moveaxis(np.rot90(masks, -1, axes=(1, 2)), 0, self.dimension)
+
+        self.modified_data = np.where(mask, 0, self.modified_data)
+        self.limpiar_dibujo()
+        self.update_image()
+
+    def procesar_volumen(self):
+        # Semillas pintadas en cualquier capa de cualquiera de las tres
+        # dimensiones; se resuelve sobre el volumen completo.
+        indices, codigos = self.trazos.semillas_volumen()
+        fondo = codigos == self.trazos.codigo("g")
+        if fondo.all() or not fondo.any():
+            tkinter.messagebox.showerror(
+                "Error", "Se necesitan semillas con ambos botones del mouse."
+            )
+            return
+        print("Procesando volumen...")
+
+        xB = -1
+        xF = 1
+
+        seeds = indices
+        seed_values = np.where(fondo, xB, xF)
+
+        try:
+            x = solve_volume(self.modified_data, seeds, seed_values)
+        except RuntimeError as error:
+            tkinter.messagebox.showerror("Error", str(error))
+            return
+
+        tau = (xB + xF) / 2
+
+        self.modified_data = np.where(x < tau, self.modified_data, 0)
+        self.limpiar_dibujo()
+        self.update_image()
+
 
 def main():
     app = GUI()
@@ -0,0 +1,825 @@
+import functools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from scipy import ndimage
+from scipy.sparse.linalg import splu
+
+try:
+    import pyamg
+except ImportError:
+    pyamg = None
+
+
+@functools.lru_cache(maxsize=8)
+def grid_edges(h, w):
+    # Aristas del grafo 4-conexo de una imagen h x w: cada píxel se une con
+    # su vecino de abajo y con el de la derecha.
+    indices = np.arange(h * w).reshape(h, w)
+    rows = np.concatenate([indices[:-1, :].ravel(), indices[:, :-1].ravel()])
+    cols = np.concatenate([indices[1:, :].ravel(), indices[:, 1:].ravel()])
+    return rows, cols
+
+
+@functools.lru_cache(maxsize=8)
+def grid_laplacian_structure(h, w):
+    # Estructura CSR del Laplaciano de la grilla h x w, que es la misma para
+    # todos los cortes del mismo tamaño, y la posición en `data` de cada
+    # arista (en ambos sentidos) y de cada elemento de la diagonal.
+    rows, cols = grid_edges(h, w)
+    n = h * w
+    m = len(rows)
+    pattern = sp.coo_matrix(
+        (
+            np.arange(1, 2 * m + n + 1),
+            (
+                np.concatenate([rows, cols, np.arange(n)]),
+                np.concatenate([cols, rows, np.arange(n)]),
+            ),
+        ),
+        shape=(n, n),
+    ).tocsr()
+    order = pattern.data - 1
+    position = np.empty(2 * m + n, dtype=np.intp)
+    position[order] = np.arange(2 * m + n)
+    return (
+        pattern.indptr,
+        pattern.indices,
+        position[:m],
+        position[m : 2 * m],
+        position[2 * m :],
+    )
+
+
+def edge_weights(img, sigma=None, epsilon=10e-6):
+    img = np.asarray(img, dtype=np.float64)
+
+    if sigma is None:
+        sigma = np.max(np.abs(np.diff(img.flatten())))
+    sigma = max(sigma, 1e-12)
+
+    diff = np.concatenate(
+        [(img[:-1, :] - img[1:, :]).ravel(), (img[:, :-1] - img[:, 1:]).ravel()]
+    )
+    return np.exp(-epsilon * diff**2 / sigma)
+
+
+def grid_laplacian(img, sigma=None, epsilon=10e-6):
+    # Arma L = D - W directamente en CSR reutilizando la estructura guardada
+    # para (h, w): sólo se calculan los valores numéricos.
+    h, w = np.shape(img)
+    indptr, indices, forward, backward, diagonal = grid_laplacian_structure(h, w)
+    rows, cols = grid_edges(h, w)
+    values = edge_weights(img, sigma, epsilon)
+
+    data = np.empty(len(indices))
+    data[forward] = -values
+    data[backward] = -values
+    data[diagonal] = np.bincount(rows, values, h * w) + np.bincount(
+        cols, values, h * w
+    )
+    return sp.csr_matrix((data, indices, indptr), shape=(h * w, h * w))
+
+
+def laplacian_coordinates_weights(img, sigma=None, epsilon=10e-6):
+    h, w = np.shape(img)
+    rows, cols = grid_edges(h, w)
+    values = edge_weights(img, sigma, epsilon)
+
+    weights = sp.coo_matrix(
+        (
+            np.concatenate([values, values]),
+            (np.concatenate([rows, cols]), np.concatenate([cols, rows])),
+        ),
+        shape=(h * w, h * w),
+    )
+    return weights.tocsr()
+
+
+def laplacian_coordinates_matrix(weights):
+    D = sp.diags(np.asarray(weights.sum(axis=1)).ravel())
+    return sp.csr_matrix(D - weights)
+
+
+def volume_weights(volume, sigma=None, epsilon=10e-6):
+    # Pesos de las aristas 6-conexas de un volumen, uno por eje y en float32;
+    # misma fórmula que en 2D.
+    volume = np.asarray(volume, dtype=np.float32)
+    if sigma is None:
+        sigma = np.max(np.abs(np.diff(volume.ravel())))
+    sigma = np.float32(max(sigma, 1e-12))
+
+    weights = []
+    for axis in range(volume.ndim):
+        d = np.diff(volume, axis=axis)
+        weights.append(np.exp(-np.float32(epsilon) * d * d / sigma))
+    return weights
+
+
+def axis_slices(ndim, axis):
+    lower = [slice(None)] * ndim
+    upper = [slice(None)] * ndim
+    lower[axis] = slice(None, -1)
+    upper[axis] = slice(1, None)
+    return tuple(lower), tuple(upper)
+
+
+def grid_apply_laplacian(weights, v):
+    # L v sin construir la matriz: (L v)_i = sum_j w_ij (v_i - v_j)
+    out = np.zeros_like(v)
+    for axis, w in enumerate(weights):
+        lower, upper = axis_slices(v.ndim, axis)
+        f = w * np.diff(v, axis=axis)
+        out[lower] -= f
+        out[upper] += f
+    return out
+
+
+def grid_degree(weights, shape):
+    degree = np.zeros(shape, dtype=np.float32)
+    for axis, w in enumerate(weights):
+        lower, upper = axis_slices(len(shape), axis)
+        degree[lower] += w
+        degree[upper] += w
+    return degree
+
+
+def grid_squared_diagonal(weights, shape):
+    # diag(L^2)_i = d_i^2 + sum_j w_ij^2
+    diagonal = grid_degree(weights, shape) ** 2
+    for axis, w in enumerate(weights):
+        lower, upper = axis_slices(len(shape), axis)
+        diagonal[lower] += w * w
+        diagonal[upper] += w * w
+    return diagonal
+
+
+def volume_laplacian(weights, shape):
+    # L armada en CSR con índices int32 y pesos float32; sólo se usa para
+    # factorizar el nivel más grueso, los productos L(L v) no la usan.
+    n = int(np.prod(shape))
+    indices = np.arange(n, dtype=np.int32).reshape(shape)
+    rows = [np.arange(n, dtype=np.int32)]
+    cols = [np.arange(n, dtype=np.int32)]
+    data = [grid_degree(weights, shape).ravel()]
+    for axis, w in enumerate(weights):
+        lower, upper = axis_slices(len(shape), axis)
+        rows += [indices[lower].ravel(), indices[upper].ravel()]
+        cols += [indices[upper].ravel(), indices[lower].ravel()]
+        data += [-w.ravel(), -w.ravel()]
+    L = sp.coo_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n, n),
+    ).tocsr()
+    L.indices = L.indices.astype(np.int32)
+    L.indptr = L.indptr.astype(np.int32)
+    return L
+
+
+def axis_index(ndim, axis, index):
+    key = [slice(None)] * ndim
+    key[axis] = index
+    return tuple(key)
+
+
+def coarse_volume_weights(weights, coarse_shape):
+    # Pesos de la grilla gruesa, cuyos nodos son los índices pares: a lo
+    # largo de cada eje las dos aristas finas entre dos nodos gruesos van en
+    # serie, y las columnas de la misma celda se suman en paralelo.
+    coarse = []
+    for axis, w in enumerate(weights):
+        m = coarse_shape[axis] - 1
+        a = w[axis_index(w.ndim, axis, slice(0, 2 * m, 2))]
+        b = w[axis_index(w.ndim, axis, slice(1, 2 * m, 2))]
+        total = a + b
+        series = np.divide(a * b, total, out=np.zeros_like(total), where=total > 0)
+        for other in range(w.ndim):
+            if other != axis:
+                series = np.add.reduceat(
+                    series, np.arange(0, series.shape[other], 2), axis=other
+                )
+        coarse.append(series)
+    return coarse
+
+
+def interpolation_fractions(weights, coarse_shape):
+    # La interpolación sigue a los pesos: el nodo impar entre dos nodos
+    # gruesos toma más del vecino con el que está mejor conectado, así no se
+    # promedia a través de un borde. La prolongación recorre los ejes del
+    # último al primero, así que en el eje `axis` los ejes anteriores todavía
+    # son gruesos.
+    fractions = []
+    for axis, w in enumerate(weights):
+        m = coarse_shape[axis] - 1
+        a = w[axis_index(w.ndim, axis, slice(0, 2 * m, 2))]
+        b = w[axis_index(w.ndim, axis, slice(1, 2 * m, 2))]
+        for other in range(axis):
+            a = a[axis_index(w.ndim, other, slice(0, None, 2))]
+            b = b[axis_index(w.ndim, other, slice(0, None, 2))]
+        total = a + b
+        fractions.append(
+            np.divide(a, total, out=np.full_like(total, 0.5), where=total > 0)
+        )
+    return fractions
+
+
+class GridLevel:
+    # Un nivel de la multigrilla: A = Is + scale L^2 aplicada sin armar, su
+    # diagonal para el suavizado y la cota de Gershgorin del espectro de
+    # D^-1 A (las filas de |L|^2 suman |L| 2d), que fija el intervalo de
+    # Chebyshev sin iteraciones de potencia.
+    def __init__(self, weights, constraints, scale):
+        self.weights = weights
+        self.constraints = constraints
+        self.scale = np.float32(scale)
+        self.shape = constraints.shape
+        self.diagonal = np.maximum(
+            constraints + self.scale * grid_squared_diagonal(weights, self.shape),
+            np.finfo(np.float32).tiny,
+        )
+        degree = grid_degree(weights, self.shape)
+        bound = 2 * degree * degree
+        for axis, w in enumerate(weights):
+            lower, upper = axis_slices(len(self.shape), axis)
+            bound[lower] += 2 * w * degree[upper]
+            bound[upper] += 2 * w * degree[lower]
+        self.upper = float(np.max((constraints + self.scale * bound) / self.diagonal))
+        self.fractions = None
+        self.solve = None
+
+    def matvec(self, v):
+        return self.constraints * v + self.scale * grid_apply_laplacian(
+            self.weights, grid_apply_laplacian(self.weights, v)
+        )
+
+    def smooth(self, x, f, degree, ratio=30):
+        # Chebyshev sobre D^-1 A en [upper / ratio, upper]: amortigua la
+        # parte alta del espectro y es simétrico, como pide el gradiente
+        # conjugado.
+        upper = self.upper
+        lower = upper / ratio
+        center = (upper + lower) / 2
+        radius = (upper - lower) / 2
+        sigma = center / radius
+        rho = 1 / sigma
+        if x is None:
+            x = np.zeros_like(f)
+            r = f.copy()
+        else:
+            r = f - self.matvec(x)
+        d = r / (center * self.diagonal)
+        for k in range(degree):
+            x += d
+            if k == degree - 1:
+                break
+            r -= self.matvec(d)
+            rho_next = 1 / (2 * sigma - rho)
+            d *= rho_next * rho
+            d += (2 * rho_next / radius) * (r / self.diagonal)
+            rho = rho_next
+        return x
+
+    def prolong(self, coarse, shape):
+        for axis in reversed(range(coarse.ndim)):
+            nc = coarse.shape[axis]
+            n = shape[axis]
+            left = self.fractions[axis]
+            fine_shape = list(coarse.shape)
+            fine_shape[axis] = n
+            fine = np.empty(fine_shape, dtype=coarse.dtype)
+            fine[axis_index(coarse.ndim, axis, slice(0, None, 2))] = coarse
+            lower, upper = axis_slices(coarse.ndim, axis)
+            odd = axis_index(coarse.ndim, axis, slice(1, 2 * nc - 2, 2))
+            fine[odd] = left * coarse[lower] + (1 - left) * coarse[upper]
+            if n % 2 == 0:
+                fine[axis_index(coarse.ndim, axis, slice(n - 1, n))] = coarse[
+                    axis_index(coarse.ndim, axis, slice(nc - 1, nc))
+                ]
+            coarse = fine
+        return coarse
+
+    def restrict(self, fine, coarse_shape):
+        # Transpuesta exacta de prolong.
+        for axis in range(fine.ndim):
+            n = fine.shape[axis]
+            nc = coarse_shape[axis]
+            left = self.fractions[axis]
+            coarse = fine[axis_index(fine.ndim, axis, slice(0, None, 2))].copy()
+            odd = fine[axis_index(fine.ndim, axis, slice(1, 2 * nc - 2, 2))]
+            coarse[axis_index(fine.ndim, axis, slice(0, nc - 1))] += left * odd
+            coarse[axis_index(fine.ndim, axis, slice(1, nc))] += (1 - left) * odd
+            if n % 2 == 0:
+                coarse[axis_index(fine.ndim, axis, slice(nc - 1, nc))] += fine[
+                    axis_index(fine.ndim, axis, slice(n - 1, n))
+                ]
+            fine = coarse
+        return fine
+
+
+class GridMultigrid:
+    # Precondicionador multigrilla geométrico para Is + L^2 sobre una grilla
+    # de cualquier dimensión (cortes 2D o volúmenes), sin armar L^2 en ningún
+    # nivel salvo el más grueso, que se factoriza. Cada nivel vuelve a
+    # discretizar la energía con los pesos engrosados; como el operador grueso
+    # sólo se parece al de Galerkin, la corrección gruesa se hace con un ciclo
+    # K (dos pasos de gradiente conjugado flexible por nivel), y así las
+    # iteraciones no crecen con el tamaño de la grilla.
+    def __init__(self, weights, constraints, coarsest=4096, degree=3):
+        self.degree = degree
+        shape = constraints.shape
+        self.levels = [GridLevel(weights, constraints, 1)]
+        while np.prod(shape) > coarsest:
+            level = self.levels[-1]
+            coarse_shape = tuple((n + 1) // 2 for n in shape)
+            level.fractions = interpolation_fractions(weights, coarse_shape)
+            weights = coarse_volume_weights(weights, coarse_shape)
+            # Is se restringe por filas (P^T s) y el factor 2^-d de L^2 es el
+            # que da P^T L^2 P con la interpolación lineal.
+            constraints = level.restrict(constraints, coarse_shape)
+            self.levels.append(
+                GridLevel(weights, constraints, level.scale / 2 ** len(shape))
+            )
+            shape = coarse_shape
+
+        last = self.levels[-1]
+        L = volume_laplacian(last.weights, shape).astype(np.float64)
+        last.solve = factorize(
+            sp.diags(last.constraints.ravel().astype(np.float64))
+            + np.float64(last.scale) * L.dot(L)
+        )
+
+    def matvec(self, v):
+        return self.levels[0].matvec(v)
+
+    def __call__(self, r):
+        return self.cycle(0, r)
+
+    def cycle(self, k, f):
+        level = self.levels[k]
+        if level.solve is not None:
+            x = level.solve(f.ravel().astype(np.float64))
+            return x.reshape(f.shape).astype(f.dtype)
+        coarse = self.levels[k + 1]
+        x = level.smooth(None, f, self.degree)
+        r = level.restrict(f - level.matvec(x), coarse.shape)
+        x += level.prolong(self.coarse_correction(k + 1, r), level.shape)
+        return level.smooth(x, f, self.degree)
+
+    def coarse_correction(self, k, f):
+        level = self.levels[k]
+        c1 = self.cycle(k, f)
+        if k >= len(self.levels) - 2:
+            return c1
+        v1 = level.matvec(c1)
+        rho1 = np.vdot(c1, v1)
+        alpha1 = np.vdot(c1, f)
+        r = f - (alpha1 / rho1) * v1
+        if np.linalg.norm(r) <= 0.25 * np.linalg.norm(f):
+            return (alpha1 / rho1) * c1
+        c2 = self.cycle(k, r)
+        v2 = level.matvec(c2)
+        gamma = np.vdot(c2, v1)
+        alpha2 = np.vdot(c2, r)
+        rho2 = np.vdot(c2, v2) - gamma * gamma / rho1
+        return (alpha1 / rho1 - gamma * alpha2 / (rho1 * rho2)) * c1 + (
+            alpha2 / rho2
+        ) * c2
+
+
+def solve_volume(
+    volume, seeds, seed_values, sigma=None, epsilon=10e-6, tol=1e-4, maxiter=200
+):
+    # Coordenadas laplacianas en 3D sin formar L^2: cada producto es L(L v)
+    # sobre la grilla con pesos float32, precondicionado con la multigrilla
+    # geométrica. Si no converge se lanza RuntimeError en lugar de devolver
+    # una segmentación a medias.
+    volume = np.asarray(volume, dtype=np.float32)
+    weights = volume_weights(volume, sigma, epsilon)
+
+    constraints = np.zeros(volume.shape, dtype=np.float32)
+    b = np.zeros(volume.shape, dtype=np.float32)
+    constraints.flat[seeds] = 1
+    b.flat[seeds] = seed_values
+
+    multigrid = GridMultigrid(weights, constraints)
+    x, iterations, converged = conjugate_gradient(
+        multigrid.matvec, b, None, multigrid, tol, maxiter
+    )
+    if not converged:
+        raise RuntimeError(
+            f"El gradiente conjugado no convergió en {iterations} iteraciones"
+        )
+    return x
+
+
+# Ordenamiento de reducción de relleno por tamaño de corte: el patrón de
+# Is + L^2 no depende de los pesos, así que se calcula una sola vez.
+factorization_orderings = {}
+
+
+def factorize(A, key=None):
+    # A es simétrica definida positiva: no hace falta pivotear.
+    options = dict(SymmetricMode=True)
+    A = sp.csc_matrix(A)
+    if key is not None and key in factorization_orderings:
+        perm = factorization_orderings[key]
+        lu = splu(
+            sp.csc_matrix(A[perm][:, perm]),
+            permc_spec="NATURAL",
+            diag_pivot_thresh=0,
+            options=options,
+        )
+    else:
+        lu = splu(A, permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0, options=options)
+        if key is not None:
+            factorization_orderings[key] = np.argsort(lu.perm_c)
+        return lu.solve
+
+    def solve(b):
+        x = np.empty_like(b)
+        x[perm] = lu.solve(b[perm])
+        return x
+
+    return solve
+
+
+def conjugate_gradient(matvec, b, x0=None, precondition=None, tol=1e-6, maxiter=1000):
+    # Gradiente conjugado precondicionado; matvec y precondition son
+    # funciones, así el operador nunca tiene que estar armado. converged es
+    # False si se agotó maxiter sin alcanzar la tolerancia: en ese caso x no
+    # es la solución y quien llama debe decidir qué hacer.
+    x = np.zeros_like(b) if x0 is None else np.array(x0, dtype=b.dtype)
+    if precondition is None:
+        precondition = lambda r: r
+    r = b - matvec(x)
+    z = precondition(r)
+    p = z.copy()
+    rz = np.vdot(r, z)
+    b_norm = max(float(np.linalg.norm(b)), 1e-12)
+    iterations = 0
+    while iterations < maxiter and np.linalg.norm(r) > tol * b_norm:
+        Ap = matvec(p)
+        alpha = rz / np.vdot(p, Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        z = precondition(r)
+        # beta de Polak-Ribière, z (r_nuevo - r_viejo) / rz: igual al usual
+        # con un precondicionador fijo y correcto también si cambia entre
+        # iteraciones, como el ciclo K de la multigrilla.
+        p *= -alpha * np.vdot(z, Ap) / rz
+        p += z
+        rz = np.vdot(r, z)
+        iterations += 1
+    converged = np.linalg.norm(r) <= tol * b_norm
+    return x, iterations, converged
+
+
+def amg_preconditioner(L, constraints):
+    # Precondicionador para Is + L^2: dos ciclos V de (L + Is), que es
+    # simétrico y definido positivo y tiene la misma estructura que L.
+    if pyamg is None:
+        raise ImportError("El precondicionador AMG necesita pyamg (pip install pyamg)")
+    ml = pyamg.smoothed_aggregation_solver(
+        sp.csr_matrix(L + sp.diags(constraints.astype(L.dtype))),
+        symmetry="symmetric",
+    )
+    cycle = ml.aspreconditioner(cycle="V")
+    return lambda r: cycle.matvec(cycle.matvec(r))
+
+
+def grid_weights(L, shape):
+    # Pesos por eje de la L de un corte h x w, leídos de sus diagonales: la
+    # w-ésima une cada píxel con el de abajo y la primera con el de la
+    # derecha (con un cero al final de cada fila, que no es arista).
+    h, w = shape
+    vertical = -L.diagonal(w).reshape(h - 1, w)
+    horizontal = -np.append(L.diagonal(1), 0).reshape(h, w)[:, :-1]
+    return [vertical.astype(np.float32), horizontal.astype(np.float32)]
+
+
+def multigrid_preconditioner(L, constraints, shape):
+    # La multigrilla de los volúmenes aplicada al corte: a diferencia de AMG
+    # sobre L + Is, las iteraciones no crecen con el tamaño de la imagen.
+    multigrid = GridMultigrid(
+        grid_weights(L, shape), constraints.reshape(shape).astype(np.float32)
+    )
+    return lambda r: multigrid(r.reshape(shape).astype(np.float32)).ravel()
+
+
+def resolve_method(n, method, shape=None):
+    # Cortes chicos: la factorización directa es la más rápida y se reutiliza
+    # al agregar semillas. En cortes grandes con forma conocida se usa la
+    # multigrilla, que no depende de pyamg.
+    if method not in ("auto", "direct", "multigrid", "amg"):
+        raise ValueError(f"Método desconocido: {method!r}")
+    if method == "amg" and pyamg is None:
+        raise ImportError("El método 'amg' necesita pyamg (pip install pyamg)")
+    if method == "multigrid" and shape is None:
+        raise ValueError("El método 'multigrid' necesita la forma del corte")
+    if method != "auto":
+        return method
+    if n <= 256 * 256:
+        return "direct"
+    if shape is not None:
+        return "multigrid"
+    if pyamg is None:
+        return "direct"
+    return "amg"
+
+
+class LaplacianCoordinatesSession:
+    # Conserva el operador armado de un corte entre llamadas. Agregar
+    # semillas sólo cambia Is y b; la solución anterior se usa como punto de
+    # partida y la factorización (o la multigrilla) anterior como
+    # precondicionador. Si CG no converge en maxiter iteraciones se pasa a la
+    # factorización directa.
+    def __init__(self, L, method="auto", shape=None):
+        self.L = sp.csr_matrix(L)
+        self.shape = shape
+        self.n = self.L.shape[0]
+        self.method = resolve_method(self.n, method, shape)
+        self.constraints = np.zeros(self.n)
+        self.b = np.zeros(self.n)
+        self.x = None
+        self.L_2 = None
+        self.factorization = None
+        self.factorized_constraints = np.zeros(0)
+        self.precondition = None
+
+    def add_seeds(self, seeds, seed_values):
+        self.constraints[seeds] = 1
+        self.b[seeds] = seed_values
+
+    def clear_seeds(self):
+        self.constraints[:] = 0
+        self.b[:] = 0
+        self.x = None
+
+    def matvec(self, v):
+        return self.constraints * v + self.L.dot(self.L.dot(v))
+
+    def solve(self, tol=1e-4, maxiter=200):
+        if self.method == "direct":
+            return self.solve_direct(tol)
+
+        x, iterations, converged = conjugate_gradient(
+            self.matvec, self.b, self.x, self.preconditioner(), tol, maxiter
+        )
+        if not converged:
+            self.fall_back_to_direct(iterations)
+            return self.solve_direct(tol)
+        self.x = x
+        return self.x
+
+    def fall_back_to_direct(self, iterations):
+        warnings.warn(
+            f"CG ({self.method}) no convergió en {iterations} iteraciones; "
+            "se usa la factorización directa",
+            RuntimeWarning,
+        )
+        self.method = "direct"
+        self.x = None
+
+    def preconditioner(self):
+        # La jerarquía se reconstruye sólo si cambiaron las semillas; su costo
+        # es pequeño comparado con las iteraciones.
+        if not np.array_equal(self.constraints, self.factorized_constraints):
+            if self.method == "multigrid":
+                self.precondition = multigrid_preconditioner(
+                    self.L, self.constraints, self.shape
+                )
+            else:
+                self.precondition = amg_preconditioner(self.L, self.constraints)
+            self.factorized_constraints = self.constraints.copy()
+        return self.precondition
+
+    def refactorize(self):
+        if self.L_2 is None:
+            self.L_2 = self.L.dot(self.L)
+        A = sp.diags(self.constraints) + self.L_2
+        self.factorization = factorize(A, self.shape)
+        self.factorized_constraints = self.constraints.copy()
+
+    def solve_many(self, B, tol=1e-4, maxiter=200):
+        # Varios lados derechos con el mismo Is: una sola factorización (o un
+        # solo precondicionador) sirve para todas las columnas de B.
+        if self.method == "direct":
+            if self.factorization is None or not np.array_equal(
+                self.constraints, self.factorized_constraints
+            ):
+                self.refactorize()
+            return self.factorization(B)
+
+        precondition = self.preconditioner()
+        X = np.empty_like(B)
+        for k in range(B.shape[1]):
+            X[:, k], iterations, converged = conjugate_gradient(
+                self.matvec, B[:, k], None, precondition, tol, maxiter
+            )
+            if not converged:
+                self.fall_back_to_direct(iterations)
+                return self.solve_many(B, tol, maxiter)
+        return X
+
+    def solve_direct(self, tol, maxiter=50):
+        if self.factorization is not None and self.x is not None:
+            if np.array_equal(self.constraints, self.factorized_constraints):
+                self.x = self.factorization(self.b)
+                return self.x
+            # Is cambió en pocas entradas: CG precondicionado con la
+            # factorización anterior converge en pocas iteraciones.
+            x, iterations, converged = conjugate_gradient(
+                self.matvec, self.b, self.x, self.factorization, tol, maxiter
+            )
+            if converged:
+                self.x = x
+                return self.x
+
+        self.refactorize()
+        self.x = self.factorization(self.b)
+        return self.x
+
+
+def solve(L, seeds, seed_values, method="auto", tol=1e-4, maxiter=200, x0=None):
+    # Minimiza ||L x||^2 + ||Is (x - b)||^2, es decir (Is + L^2) x = b.
+    session = LaplacianCoordinatesSession(L, method)
+    session.add_seeds(seeds, seed_values)
+    session.x = x0
+    return session.solve(tol, maxiter)
+
+
+def solve_labels(
+    L, seeds, seed_labels, n_labels, method="auto", tol=1e-4, maxiter=200, shape=None
+):
+    # Una columna por etiqueta: 1 en sus semillas y 0 en las demás. Todas
+    # comparten Is + L^2 y cada píxel toma la etiqueta de mayor respuesta.
+    session = LaplacianCoordinatesSession(L, method, shape)
+    session.add_seeds(seeds, 0)
+    B = np.zeros((session.n, n_labels))
+    B[seeds, seed_labels] = 1
+    X = session.solve_many(B, tol, maxiter)
+    return np.argmax(X, axis=1), X
+
+
+def slic_superpixels(img, n_segments=2000, compactness=10.0, iterations=5):
+    # SLIC vectorizado: cada píxel sólo se compara con los centros de las
+    # 3x3 celdas de la grilla inicial que rodean a la suya.
+    img = np.asarray(img, dtype=np.float64)
+    h, w = img.shape
+    step = max(int(np.sqrt(h * w / n_segments)), 1)
+    gh, gw = -(-h // step), -(-w // step)
+
+    yy, xx = np.mgrid[0:h, 0:w]
+    cell_y, cell_x = yy // step, xx // step
+    center_y = np.minimum((np.arange(gh) + 0.5) * step, h - 1)
+    center_y, center_x = np.meshgrid(
+        center_y, np.minimum((np.arange(gw) + 0.5) * step, w - 1), indexing="ij"
+    )
+    center_y, center_x = center_y.ravel(), center_x.ravel()
+    center_value = img[center_y.astype(int), center_x.astype(int)]
+
+    scale = max(float(img.max() - img.min()), 1e-12) / compactness
+    labels = np.zeros((h, w), dtype=np.int32)
+    for i in range(iterations):
+        best = np.full((h, w), np.inf)
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                cy, cx = cell_y + dy, cell_x + dx
+                valid = (cy >= 0) & (cy < gh) & (cx >= 0) & (cx < gw)
+                k = np.where(valid, cy * gw + cx, 0)
+                distance = ((img - center_value[k]) / scale) ** 2 + (
+                    (yy - center_y[k]) ** 2 + (xx - center_x[k]) ** 2
+                ) / step**2
+                distance[~valid] = np.inf
+                closer = distance < best
+                best[closer] = distance[closer]
+                labels[closer] = k[closer]
+
+        counts = np.maximum(np.bincount(labels.ravel(), minlength=gh * gw), 1)
+        center_y = np.bincount(labels.ravel(), yy.ravel(), gh * gw) / counts
+        center_x = np.bincount(labels.ravel(), xx.ravel(), gh * gw) / counts
+        center_value = np.bincount(labels.ravel(), img.ravel(), gh * gw) / counts
+
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels.reshape(h, w).astype(np.int32)
+
+
+def coarse_laplacian(W, labels):
+    # Grafo de adyacencia de regiones: W_c = P^T W P con P la asignación
+    # píxel -> región, así el peso entre dos regiones es la suma de los pesos
+    # de las aristas de su frontera.
+    n = labels.size
+    regions = int(labels.max()) + 1
+    P = sp.csr_matrix(
+        (np.ones(n), (np.arange(n), labels.ravel())), shape=(n, regions)
+    )
+    W_c = sp.csr_matrix(P.T.dot(W).dot(P))
+    W_c.setdiag(0)
+    W_c.eliminate_zeros()
+    return laplacian_coordinates_matrix(W_c)
+
+
+def solve_superpixels(
+    img, seeds, seed_values, n_segments=2000, band=3, sigma=None, epsilon=10e-6
+):
+    # Resuelve primero sobre el grafo de superpíxeles y luego sólo en una
+    # banda de `band` píxeles alrededor de la frontera gruesa, con los
+    # píxeles de afuera de la banda fijos al valor de la solución gruesa.
+    h, w = np.shape(img)
+    labels = slic_superpixels(img, n_segments)
+    W = laplacian_coordinates_weights(img, sigma, epsilon)
+    L = laplacian_coordinates_matrix(W)
+
+    seed_regions = labels.ravel()[seeds]
+    coarse_x = solve(coarse_laplacian(W, labels), seed_regions, seed_values)
+    x = np.sign(coarse_x[labels]).ravel()
+
+    x_image = x.reshape(h, w)
+    boundary = np.zeros((h, w), dtype=bool)
+    boundary[:-1, :] |= x_image[:-1, :] != x_image[1:, :]
+    boundary[1:, :] |= x_image[:-1, :] != x_image[1:, :]
+    boundary[:, :-1] |= x_image[:, :-1] != x_image[:, 1:]
+    boundary[:, 1:] |= x_image[:, :-1] != x_image[:, 1:]
+    if not boundary.any():
+        return x
+
+    free = ndimage.binary_dilation(boundary, iterations=band)
+    # ||L x||^2 acopla vecinos a distancia 2: dos anillos fijos alrededor
+    domain = ndimage.binary_dilation(free, iterations=2).ravel()
+    free = free.ravel()
+    free[seeds] = False
+
+    domain_index = np.flatnonzero(domain)
+    local = np.full(h * w, -1)
+    local[domain_index] = np.arange(len(domain_index))
+    fixed = domain_index[~free[domain_index]]
+
+    x[seeds] = seed_values
+    L_band = L[domain_index][:, domain_index]
+    x[domain_index] = solve(L_band, local[fixed], x[fixed])
+    return x
+
+
+def segment_slice(img, seeds, seed_values, method="auto"):
+    # Semillas de fondo en -1 y de objeto en 1; el objeto es x >= 0.
+    session = LaplacianCoordinatesSession(grid_laplacian(img), method, img.shape)
+    session.add_seeds(seeds, seed_values)
+    return session.solve().reshape(img.shape) >= 0
+
+
+def propagate_chunk(slices, seeds, seed_values, erosion=2, method="auto"):
+    # slices está ordenado en el sentido de la propagación y slices[0] es el
+    # corte anotado. La segmentación de cada corte, erosionada, da las
+    # semillas del siguiente; si el objeto desaparece, el resto queda vacío.
+    masks = np.zeros(slices.shape, dtype=bool)
+    for k in range(len(slices)):
+        foreground = segment_slice(slices[k], seeds, seed_values, method)
+        masks[k] = foreground
+        foreground_seeds = ndimage.binary_erosion(foreground, iterations=erosion)
+        background_seeds = ndimage.binary_erosion(~foreground, iterations=erosion)
+        if not foreground_seeds.any() or not background_seeds.any():
+            break
+        seeds = np.flatnonzero(foreground_seeds | background_seeds)
+        seed_values = np.where(foreground_seeds.ravel()[seeds], 1.0, -1.0)
+    return masks
+
+
+def propagate_volume(
+    volume, annotations, axis=0, erosion=2, method="auto", max_workers=None
+):
+    # annotations: {índice de corte: (semillas, valores)} con índices planos
+    # dentro del corte. Cada corte anotado se encarga de los cortes más
+    # cercanos a él; hacia adelante y hacia atrás son trabajos independientes
+    # que se reparten en un pool de procesos.
+    stack = np.moveaxis(np.asarray(volume, dtype=np.float32), axis, 0)
+    n = stack.shape[0]
+    annotated = sorted(annotations)
+    bounds = [0] + [(a + b) // 2 + 1 for a, b in zip(annotated, annotated[1:])] + [n]
+
+    masks = np.zeros(stack.shape, dtype=bool)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        jobs = []
+        for k, start, stop in zip(annotated, bounds, bounds[1:]):
+            seeds, seed_values = annotations[k]
+            forward = np.ascontiguousarray(stack[k:stop])
+            backward = np.ascontiguousarray(stack[start : k + 1][::-1])
+            jobs.append(
+                (
+                    slice(k, stop),
+                    executor.submit(
+                        propagate_chunk, forward, seeds, seed_values, erosion, method
+                    ),
+                )
+            )
+            jobs.append(
+                (
+                    slice(k, start - 1 if start > 0 else None, -1),
+                    executor.submit(
+                        propagate_chunk, backward, seeds, seed_values, erosion, method
+                    ),
+                )
+            )
+        for index, job in jobs:
+            masks[index] |= job.result()
+    return np.moveaxis(masks, 0, axis)
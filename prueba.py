@@ -5,9 +5,9 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
 from scipy.spatial.distance import pdist, squareform
 import scipy
-import scipy.sparse as sp
-from scipy.sparse.linalg import spsolve, factorized
 from PIL import Image
+from laplacian_coordinates import laplacian_coordinates_weights, laplacian_coordinates_matrix, solve
+from trazos import Trazos
 
 class AplicacionDibujo:
     def __init__(self, ventana):
@@ -23,7 +23,7 @@ class AplicacionDibujo:
 
         self.imagen = None
 
-        self.coordenadas = []
+        self.trazos = Trazos(self.ax)
 
         self.figura.canvas.mpl_connect("button_press_event", self.on_click)
         self.figura.canvas.mpl_connect("motion_notify_event", self.on_drag)
@@ -41,7 +41,8 @@ class AplicacionDibujo:
         self.menu_archivo.add_command(label="Salir", command=ventana.quit)
 
     def mostrar_coordenadas(self):
-        print(self.coordenadas)
+        filas, columnas, codigos = self.trazos.semillas()
+        print(filas, columnas, [self.trazos.paleta[c] for c in codigos])
 
     def abrir_imagen(self):
         ruta_imagen = filedialog.askopenfilename(title="Abrir imagen", filetypes=[("Archivos de imagen", "*.png;*.jpg;*.jpeg")])
@@ -63,69 +64,40 @@ class AplicacionDibujo:
                 color = 'r'  # Rojo
             else:
                 return
-            self.coordenadas.append((x, y, color))
-            for coord in self.coordenadas:
-                self.ax.plot(coord[0], coord[1], marker='o', markersize=5, color=coord[2])
-            self.figura.canvas.draw()
+            self.trazos.agregar(y, x, color)
+            self.trazos.dibujar()
     
     def on_click(self, event):
         if event.inaxes == self.ax:
             x = int(round(event.xdata))
             y = int(round(event.ydata))
             color = 'g' if event.button == 1 else 'r'
-            self.coordenadas.append((y, x, color))
-            self.ax.plot(x, y, marker='o', markersize=5, color=color)
-            self.figura.canvas.draw()
+            self.trazos.agregar(y, x, color)
+            self.trazos.dibujar()
 
     def on_drag(self, event):
         if event.inaxes == self.ax and event.button == 1:
             x = int(round(event.xdata))
             y = int(round(event.ydata))
             color = 'g' if event.button == 1 else 'r'
-            self.coordenadas.append((y, x, color))
-            self.ax.plot(x, y, marker='o', markersize=5, color=color)
-            self.figura.canvas.draw()
+            self.trazos.agregar(y, x, color)
+            self.trazos.dibujar()
 
     def on_release(self, event):
-        if event.inaxes == self.ax:
-            self.figura.canvas.draw()
+        pass
 
     def limpiar_dibujo(self):
-        self.coordenadas = []
-        
-        for line in self.ax.lines:
-            line.remove()
-            
-        self.figura.canvas.draw()
+        self.trazos.limpiar()
 
     def procesar(self):
-        if not self.coordenadas:
+        if not len(self.trazos):
             return
         print("Procesando...")
-        # print(self.coordenadas)
+        filas, columnas, codigos = self.trazos.semillas()
+        fondo = codigos == self.trazos.codigo('g')
 
         h, w = self.imagen.shape
         
-        def laplacian_coordinates_weights(img, epsilon=10e-6):
-            weights = sp.lil_matrix((h*w, h*w))
-
-            sigma = np.max(np.abs(np.diff(self.imagen.flatten())))
-            print("Sigma: ", sigma)
-
-            for i in range(h):
-                for j in range(w):
-                    idx = i*w + j
-                    if i > 0:
-                        weights[idx, (i-1)*w+j] = np.exp(- epsilon * ((img[i,j] - img[i-1,j])**2).sum() / sigma)
-                    if i < h-1:
-                        weights[idx, (i+1)*w+j] = np.exp(- epsilon * ((img[i,j] - img[i+1,j])**2).sum() / sigma)
-                    if j > 0:
-                        weights[idx, i*w+j-1] = np.exp(- epsilon * ((img[i,j] - img[i,j-1])**2).sum() / sigma)
-                    if j < w-1:
-                        weights[idx, i*w+j+1] = np.exp(- epsilon * ((img[i,j] - img[i,j+1])**2).sum() / sigma)
-
-            return weights
-
         weights = laplacian_coordinates_weights(self.imagen)
         print("Tamaño matrix de pesos: ", weights.shape)
 
@@ -133,24 +105,17 @@ class AplicacionDibujo:
         # plt.colorbar()
         # plt.show()
 
-        def laplacian_coordinates_matrix(weights):
-            D = sp.diags(weights.sum(axis=1).A.ravel())
-            return D - weights
-        
         L = laplacian_coordinates_matrix(weights)
         print("Tamaño matrix de Laplacian: ", L.shape)
 
         xB = 0
         xF = 0
 
-        for i, j, color in self.coordenadas:
-            if color == 'g':
-                xB += self.imagen[i, j]
-            else:
-                xF += self.imagen[i, j]
+        xB += self.imagen[filas[fondo], columnas[fondo]].sum()
+        xF += self.imagen[filas[~fondo], columnas[~fondo]].sum()
 
-        # xB = xB / len([c for c in self.coordenadas if c[2] == 'g'])
-        # xF = xF / len([c for c in self.coordenadas if c[2] == 'r'])
+        # xB = xB / np.count_nonzero(fondo)
+        # xF = xF / np.count_nonzero(~fondo)
 
         xB = -1
         xF = 1
@@ -158,22 +123,10 @@ class AplicacionDibujo:
         print("xB: ", xB)
         print("xF: ", xF)
         
-        Is = sp.lil_matrix((h*w, h*w))
-        L_2 = L.dot(L)
-        b = np.zeros(h*w)
-        
-        indices = np.array([[i*w+j for j in range(w)] for i in range(h)])
-        for (i, j, color) in self.coordenadas:
-            index = indices[i, j]
-            Is[index, index] = 1
-            b[index] = xB if color == 'g' else xF
-            # print(i, j, color)    
-
-        print("Tamaño matrix de Is: ", Is.shape)
-
-        A = sp.csr_matrix(Is + L_2)
-        solve = factorized(A)
-        x = solve(b)
+        seeds = filas*w + columnas
+        seed_values = np.where(fondo, xB, xF)
+
+        x = solve(L, seeds, seed_values)
 
         segmented_image = x.reshape((h, w))
 
@@ -0,0 +1,499 @@
+import csv
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import time
+import numpy as np
+import SimpleITK as sitk
+
+# nibabel usa coordenadas RAS y los índices (i, j, k) en orden Fortran; ITK
+# usa LPS y espera el arreglo en orden (k, j, i).
+RAS_TO_LPS = np.diag([-1.0, -1.0, 1.0])
+
+# Pirámide de resolución (factores de reducción y suavizado por nivel),
+# muestreo de la métrica y optimizador. Los niveles gruesos se resuelven con
+# pocas muestras; sólo el último nivel ve la imagen a resolución completa.
+PRESETS = {
+    "fast": dict(
+        metric="mean_squares",
+        shrink_factors=(4, 2),
+        smoothing_sigmas=(2.0, 1.0),
+        sampling="random",
+        sampling_percentage=0.02,
+        learning_rate=1.0,
+        min_step=1e-3,
+        iterations=60,
+    ),
+    "balanced": dict(
+        metric="mean_squares",
+        shrink_factors=(4, 2, 1),
+        smoothing_sigmas=(2.0, 1.0, 0.0),
+        sampling="random",
+        sampling_percentage=0.05,
+        learning_rate=1.0,
+        min_step=1e-4,
+        iterations=100,
+    ),
+    "accurate": dict(
+        metric="mattes",
+        shrink_factors=(8, 4, 2, 1),
+        smoothing_sigmas=(3.0, 2.0, 1.0, 0.0),
+        sampling="regular",
+        sampling_percentage=0.2,
+        learning_rate=1.0,
+        min_step=1e-5,
+        gradient_tolerance=1e-8,
+        iterations=200,
+    ),
+}
+
+
+def nifti_to_sitk(data, affine):
+    # Los volúmenes de nibabel vienen en orden Fortran: la transpuesta ya es
+    # contigua en C y SimpleITK la copia una única vez, sin reordenar ejes.
+    array = np.ascontiguousarray(np.asarray(data, dtype=np.float32).T)
+    image = sitk.GetImageFromArray(array)
+
+    matrix = RAS_TO_LPS @ np.asarray(affine, dtype=np.float64)[:3, :3]
+    spacing = np.linalg.norm(matrix, axis=0)
+    image.SetSpacing(spacing.tolist())
+    image.SetDirection((matrix / spacing).ravel().tolist())
+    image.SetOrigin((RAS_TO_LPS @ np.asarray(affine, dtype=np.float64)[:3, 3]).tolist())
+    return image
+
+
+def image_from_nifti(nib_image):
+    return nifti_to_sitk(
+        nib_image.get_fdata(dtype=np.float32, caching="unchanged"), nib_image.affine
+    )
+
+
+def sitk_affine(image):
+    direction = np.reshape(image.GetDirection(), (3, 3))
+    affine = np.eye(4)
+    affine[:3, :3] = RAS_TO_LPS @ direction * np.asarray(image.GetSpacing())
+    affine[:3, 3] = RAS_TO_LPS @ np.asarray(image.GetOrigin())
+    return affine
+
+
+def sitk_to_nifti(image):
+    # Una sola copia del buffer de ITK; la transpuesta devuelve el orden
+    # (i, j, k) de nibabel sin copiar otra vez.
+    return sitk.GetArrayFromImage(image).T, sitk_affine(image)
+
+
+class RegistrationMonitor:
+    # Observa las iteraciones de una o varias etapas desde el hilo que
+    # ejecuta el registro: guarda cada una en log y la deja en queue para que
+    # la interfaz la lea sin bloquearse. cancel() detiene el optimizador en
+    # la próxima iteración.
+    def __init__(self):
+        self.log = []
+        self.queue = queue.Queue()
+        self.cancelled = False
+        self.level = 0
+        self.start = time.perf_counter()
+
+    def attach(self, method, stage):
+        method.AddCommand(
+            sitk.sitkIterationEvent, lambda: self.iteration(method, stage)
+        )
+
+    def iteration(self, method, stage):
+        if isinstance(method, sitk.ImageRegistrationMethod):
+            level = method.GetCurrentLevel()
+            iteration = method.GetOptimizerIteration()
+            metric = method.GetMetricValue()
+        else:
+            level = self.level
+            iteration = method.GetElapsedIterations()
+            metric = method.GetMetric()
+        record = dict(
+            stage=stage,
+            level=level,
+            iteration=iteration,
+            metric=metric,
+            seconds=time.perf_counter() - self.start,
+        )
+        self.log.append(record)
+        self.queue.put(record)
+        if self.cancelled:
+            method.StopRegistration()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def save(self, path, **run):
+        # Agrega las iteraciones al CSV con los datos de la corrida (preset,
+        # etapa, etc.) para comparar configuraciones entre sujetos.
+        fields = list(run) + ["stage", "level", "iteration", "metric", "seconds"]
+        exists = os.path.exists(path)
+        with open(path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            if not exists:
+                writer.writeheader()
+            writer.writerows(dict(record, **run) for record in self.log)
+
+
+def registration_parameters(preset="balanced", **overrides):
+    parameters = dict(PRESETS[preset])
+    parameters.update(overrides)
+    return parameters
+
+
+def registration_method(
+    metric="mean_squares",
+    shrink_factors=(1,),
+    smoothing_sigmas=(0.0,),
+    sampling="none",
+    sampling_percentage=1.0,
+    learning_rate=1.0,
+    min_step=1e-4,
+    iterations=100,
+    gradient_tolerance=1e-4,
+    histogram_bins=50,
+    seed=0,
+    estimate_scales=True,
+):
+    method = sitk.ImageRegistrationMethod()
+
+    if metric == "mattes":
+        method.SetMetricAsMattesMutualInformation(numberOfHistogramBins=histogram_bins)
+    elif metric == "mean_squares":
+        method.SetMetricAsMeanSquares()
+    else:
+        raise ValueError(f"Métrica desconocida: {metric}")
+
+    if sampling == "random":
+        method.SetMetricSamplingStrategy(method.RANDOM)
+    elif sampling == "regular":
+        method.SetMetricSamplingStrategy(method.REGULAR)
+    else:
+        method.SetMetricSamplingStrategy(method.NONE)
+    if sampling != "none":
+        method.SetMetricSamplingPercentage(sampling_percentage, seed)
+
+    method.SetShrinkFactorsPerLevel(list(shrink_factors))
+    method.SetSmoothingSigmasPerLevel(list(smoothing_sigmas))
+    method.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
+
+    method.SetInterpolator(sitk.sitkLinear)
+    method.SetOptimizerAsRegularStepGradientDescent(
+        learningRate=learning_rate,
+        minStep=min_step,
+        numberOfIterations=iterations,
+        gradientMagnitudeTolerance=gradient_tolerance,
+    )
+    if estimate_scales:
+        method.SetOptimizerScalesFromPhysicalShift()
+    return method
+
+
+def register_affine(
+    fixed_image,
+    moving_image,
+    preset="balanced",
+    cache=None,
+    monitor=None,
+    **overrides,
+):
+    # Devuelve la transformación que lleva puntos de la imagen fija a la
+    # móvil, lista para sitk.Resample, y un diccionario con la métrica final,
+    # la condición de parada y el tiempo.
+    fixed_image = sitk.Cast(fixed_image, sitk.sitkFloat32)
+    moving_image = sitk.Cast(moving_image, sitk.sitkFloat32)
+    parameters = registration_parameters(preset, **overrides)
+
+    if cache is not None:
+        key = cache.key(fixed_image, moving_image, dict(parameters, stage="affine"))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    start = time.perf_counter()
+    method = registration_method(**parameters)
+    initial_transform = sitk.CenteredTransformInitializer(
+        fixed_image,
+        moving_image,
+        sitk.AffineTransform(3),
+        sitk.CenteredTransformInitializerFilter.GEOMETRY,
+    )
+    method.SetInitialTransform(initial_transform, inPlace=False)
+    if monitor is not None:
+        monitor.attach(method, "affine")
+    final_transform = method.Execute(fixed_image, moving_image)
+    info = dict(
+        metric=method.GetMetricValue(),
+        iterations=method.GetOptimizerIteration(),
+        stop_condition=method.GetOptimizerStopConditionDescription(),
+        seconds=time.perf_counter() - start,
+        parameters=parameters,
+        cached=False,
+        cancelled=monitor is not None and monitor.cancelled,
+    )
+
+    # Si no se puede guardar en la caché (disco lleno, permisos) el registro
+    # sigue siendo válido: el error sólo queda anotado en info.
+    if cache is not None and not info["cancelled"]:
+        try:
+            cache.put(key, final_transform, info)
+        except (OSError, RuntimeError) as error:
+            info["cache_error"] = f"{type(error).__name__}: {error}"
+    return final_transform, info
+
+
+def register_bspline(
+    fixed_image,
+    moving_image,
+    affine_transform,
+    preset="balanced",
+    mesh_size=4,
+    monitor=None,
+    **overrides,
+):
+    # Etapa no lineal sobre la afín ya optimizada: la grilla de puntos de
+    # control empieza gruesa y se duplica en cada nivel de la pirámide. El
+    # resultado es una sola transformación compuesta (primero la B-spline,
+    # después la afín) para remuestrear una única vez.
+    fixed_image = sitk.Cast(fixed_image, sitk.sitkFloat32)
+    moving_image = sitk.Cast(moving_image, sitk.sitkFloat32)
+    parameters = registration_parameters(preset, **overrides)
+
+    start = time.perf_counter()
+    # Estimar escalas cuesta en proporción a la cantidad de parámetros, que
+    # en la B-spline son miles; LBFGS2 no las usa.
+    method = registration_method(**parameters, estimate_scales=False)
+    # LBFGSB no admite que la cantidad de parámetros cambie entre niveles.
+    method.SetOptimizerAsLBFGS2(
+        solutionAccuracy=1e-2,
+        numberOfIterations=parameters["iterations"],
+        deltaConvergenceTolerance=0.01,
+    )
+    levels = len(parameters["shrink_factors"])
+    bspline = sitk.BSplineTransformInitializer(fixed_image, [mesh_size] * 3)
+    method.SetMovingInitialTransform(affine_transform)
+    method.SetInitialTransformAsBSpline(
+        bspline, inPlace=True, scaleFactors=[2**level for level in range(levels)]
+    )
+    if monitor is not None:
+        monitor.attach(method, "bspline")
+    method.Execute(fixed_image, moving_image)
+
+    transform = sitk.CompositeTransform(affine_transform)
+    transform.AddTransform(bspline)
+    info = dict(
+        metric=method.GetMetricValue(),
+        iterations=method.GetOptimizerIteration(),
+        stop_condition=method.GetOptimizerStopConditionDescription(),
+        seconds=time.perf_counter() - start,
+        parameters=dict(parameters, mesh_size=mesh_size),
+        cached=False,
+        cancelled=monitor is not None and monitor.cancelled,
+    )
+    return transform, info
+
+
+def register_demons(
+    fixed_image,
+    moving_image,
+    affine_transform,
+    shrink_factors=(4, 2),
+    iterations=(60, 30),
+    smoothing=1.5,
+    monitor=None,
+):
+    # Demons simétrico rápido de grueso a fino sobre la móvil ya llevada a la
+    # grilla fija por la afín. El campo de desplazamientos se queda en el
+    # último nivel de la pirámide (la mitad de resolución por defecto, un
+    # octavo de la memoria) y la transformación lo interpola.
+    fixed_image = sitk.Cast(fixed_image, sitk.sitkFloat32)
+    moving_image = sitk.Cast(
+        resample(moving_image, fixed_image, affine_transform), sitk.sitkFloat32
+    )
+
+    start = time.perf_counter()
+    field = None
+    demons = sitk.FastSymmetricForcesDemonsRegistrationFilter()
+    demons.SetSmoothDisplacementField(True)
+    demons.SetStandardDeviations(smoothing)
+    if monitor is not None:
+        monitor.attach(demons, "demons")
+    for level, (shrink, level_iterations) in enumerate(zip(shrink_factors, iterations)):
+        if monitor is not None:
+            if monitor.cancelled and field is not None:
+                break
+            monitor.level = level
+        fixed_level = sitk.BinShrink(fixed_image, [shrink] * 3)
+        moving_level = sitk.BinShrink(moving_image, [shrink] * 3)
+        if field is None:
+            field = sitk.Image(fixed_level.GetSize(), sitk.sitkVectorFloat64, 3)
+            field.CopyInformation(fixed_level)
+        else:
+            field = sitk.Resample(
+                field, fixed_level, sitk.Transform(), sitk.sitkLinear, 0.0
+            )
+        demons.SetNumberOfIterations(level_iterations)
+        field = demons.Execute(fixed_level, moving_level, field)
+
+    displacement = sitk.DisplacementFieldTransform(field)
+    transform = sitk.CompositeTransform(affine_transform)
+    transform.AddTransform(displacement)
+    info = dict(
+        metric=demons.GetMetric(),
+        iterations=demons.GetElapsedIterations(),
+        stop_condition="Demons: " + str(sum(iterations)) + " iteraciones",
+        seconds=time.perf_counter() - start,
+        parameters=dict(
+            shrink_factors=shrink_factors, iterations=iterations, smoothing=smoothing
+        ),
+        cached=False,
+        cancelled=monitor is not None and monitor.cancelled,
+    )
+    return transform, info
+
+
+def resample_slice(
+    moving_image, fixed_image, transform, axis, index, default_value=0.0
+):
+    # Remuestrea sólo el plano index del eje axis de la grilla fija (ejes en
+    # el orden (i, j, k) de nibabel) y lo devuelve como arreglo 2D.
+    size = list(fixed_image.GetSize())
+    start = [0, 0, 0]
+    start[axis] = int(index)
+    size[axis] = 1
+
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetSize(size)
+    resampler.SetOutputOrigin(fixed_image.TransformIndexToPhysicalPoint(start))
+    resampler.SetOutputSpacing(fixed_image.GetSpacing())
+    resampler.SetOutputDirection(fixed_image.GetDirection())
+    resampler.SetTransform(transform)
+    resampler.SetInterpolator(sitk.sitkLinear)
+    resampler.SetDefaultPixelValue(default_value)
+    resampler.SetOutputPixelType(moving_image.GetPixelID())
+    image = resampler.Execute(moving_image)
+    return np.squeeze(sitk.GetArrayFromImage(image).T, axis)
+
+
+def normalize_slice(data):
+    data = np.asarray(data, dtype=np.float32)
+    low, high = np.min(data), np.max(data)
+    return (data - low) / max(high - low, 1e-12)
+
+
+def fuse_slices(fixed_slice, moving_slice, mode="checkerboard", squares=8, alpha=0.5):
+    # Superpone el corte fijo y el móvil ya remuestreado, cada uno llevado a
+    # [0, 1]: tablero de ajedrez o mezcla lineal.
+    fixed_slice = normalize_slice(fixed_slice)
+    moving_slice = normalize_slice(moving_slice)
+    if mode == "blend":
+        return (1 - alpha) * fixed_slice + alpha * moving_slice
+
+    tile = max(1, min(fixed_slice.shape) // squares)
+    rows, cols = np.indices(fixed_slice.shape)
+    board = (rows // tile + cols // tile) % 2 == 1
+    return np.where(board, moving_slice, fixed_slice)
+
+
+def image_digest(image, digest):
+    digest.update(repr((image.GetSize(), image.GetPixelIDValue())).encode())
+    digest.update(repr((image.GetSpacing(), image.GetOrigin())).encode())
+    digest.update(repr(image.GetDirection()).encode())
+    digest.update(sitk.GetArrayViewFromImage(image))
+
+
+class TransformCache:
+    # Transformaciones ya optimizadas, guardadas como .tfm con sus metadatos
+    # en .json. La clave es un hash del contenido de ambos volúmenes y de los
+    # parámetros; el .json se toca en cada acierto y al superar max_entries
+    # se borran las entradas usadas hace más tiempo. Varios procesos pueden
+    # compartir la carpeta: los archivos se escriben aparte y se publican con
+    # os.replace, y una entrada que desaparece o está a medias es un fallo de
+    # caché.
+    def __init__(self, directory="transform_cache", max_entries=64):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, fixed_image, moving_image, parameters):
+        digest = hashlib.blake2b(digest_size=20)
+        image_digest(fixed_image, digest)
+        image_digest(moving_image, digest)
+        digest.update(json.dumps(parameters, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".tfm", base + ".json"
+
+    def get(self, key):
+        transform_path, metadata_path = self.paths(key)
+        if not os.path.exists(transform_path):
+            return None
+        try:
+            with open(metadata_path) as f:
+                info = json.load(f)
+            transform = sitk.ReadTransform(transform_path)
+            os.utime(metadata_path)
+        except (OSError, ValueError, RuntimeError):
+            return None
+        info["cached"] = True
+        return transform, info
+
+    def temporary(self, suffix):
+        # El sufijo final no es .json para que evict no tome archivos a medio
+        # escribir; el .tfm lo conserva porque SimpleITK elige el formato por
+        # la extensión.
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+        os.close(fd)
+        return path
+
+    def put(self, key, transform, info):
+        transform_path, metadata_path = self.paths(key)
+        # El .json se publica último: una entrada existe cuando su .tfm ya
+        # está completo.
+        temporary_transform = self.temporary(".tmp.tfm")
+        temporary_metadata = self.temporary(".json.tmp")
+        try:
+            sitk.WriteTransform(transform, temporary_transform)
+            with open(temporary_metadata, "w") as f:
+                json.dump(dict(info, key=key, created=time.time()), f, indent=2)
+            os.replace(temporary_transform, transform_path)
+            os.replace(temporary_metadata, metadata_path)
+        finally:
+            for path in (temporary_transform, temporary_metadata):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            metadata_path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(metadata_path), metadata_path))
+            except FileNotFoundError:
+                continue
+        entries.sort(reverse=True)
+        for _, metadata_path in entries[self.max_entries :]:
+            base = os.path.splitext(metadata_path)[0]
+            for path in (metadata_path, base + ".tfm"):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+def resample(moving_image, fixed_image, transform, default_value=0.0):
+    return sitk.Resample(
+        moving_image,
+        fixed_image,
+        transform,
+        sitk.sitkLinear,
+        default_value,
+        moving_image.GetPixelID(),
+    )
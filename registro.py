@@ -9,18 +9,38 @@ import matplotlib.pyplot
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from scipy import ndimage
 from queue import Queue
+import threading
+import time
 from skimage import io, img_as_ubyte
 from scipy.signal import find_peaks
-import SimpleITK as sitk
 from scipy.ndimage import laplace
 import numpy as np
 from scipy.sparse import spdiags
 from scipy.sparse.linalg import spsolve
+from registration import (
+    register_affine,
+    register_bspline,
+    register_demons,
+    resample,
+    nifti_to_sitk,
+    sitk_to_nifti,
+    TransformCache,
+    RegistrationMonitor,
+    resample_slice,
+    fuse_slices,
+)
 
 customtkinter.set_appearance_mode("Dark")
 customtkinter.set_default_color_theme("green")
 
 
+def magnitud_gradiente(data, axes=(0, 1)):
+    magnitude = np.zeros(np.shape(data), dtype=np.float64)
+    for axis in axes:
+        magnitude += ndimage.sobel(data, axis) ** 2
+    return np.sqrt(magnitude)
+
+
 class GUI(customtkinter.CTk):
     def __init__(self):
         super().__init__()
@@ -43,6 +63,12 @@ class GUI(customtkinter.CTk):
         self.moving_image = None
         self.moving_nib_image = None
         self.moving_data = None
+        self.moving_affine = None
+        self.transform_cache = None
+        self.registration_monitor = None
+        self.moving_transform = None
+        self.registration_fixed = None
+        self.registration_moving = None
         self.moving_modified_data = None
         
         self.dimension = 1
@@ -340,9 +366,7 @@ class GUI(customtkinter.CTk):
         self.no_registro()
 
         def apply_borders():
-            sobel_h = ndimage.sobel(self.modified_data, 0)
-            sobel_v = ndimage.sobel(self.modified_data, 1)
-            magnitude = np.sqrt(sobel_h ** 2 + sobel_v ** 2)
+            magnitude = magnitud_gradiente(self.modified_data)
             magnitude *= 255.0 / np.max(magnitude)
 
             self.modified_data = magnitude > 30
@@ -373,7 +397,15 @@ class GUI(customtkinter.CTk):
         if file_path:
             self.moving_image = nibabel.load(file_path)
             self.moving_data = self.moving_image.get_fdata()
+            self.moving_affine = self.moving_image.affine
             self.moving_shape = self.moving_data.shape
+            # Una transformación calculada para otra imagen móvil no sirve
+            # para la vista previa ni para guardar.
+            self.moving_transform = None
+            self.registration_moving = None
+            self.registration_fixed = None
+            self.save_registered_button.configure(state="disabled")
+            self.preview_select.configure(state="disabled")
             self.select_file2.destroy()
             self.moving_layer_slider.configure(from_=0, to=self.moving_shape[self.dimension] - 1)
             self.moving_layer_slider.configure(state="normal")
@@ -400,10 +432,30 @@ class GUI(customtkinter.CTk):
         else:
             dimension = 2
         
-        layer = int(self.moving_layer_slider.get())
+        # Con una transformación vigente se muestra la grilla fija: sólo se
+        # remuestrea el plano visible, no el volumen completo.
+        if self.moving_transform is not None:
+            shape = self.file_shape
+        else:
+            shape = self.moving_shape
+        self.moving_layer_slider.configure(to=shape[dimension] - 1)
+        layer = min(int(self.moving_layer_slider.get()), shape[dimension] - 1)
         self.moving_layer_label.configure(text=f"Layer: {layer}")
 
-        if dimension == 0:
+        if self.moving_transform is not None:
+            moving_slice = resample_slice(
+                self.registration_moving,
+                self.registration_fixed,
+                self.moving_transform,
+                dimension,
+                layer,
+            )
+            mode = self.preview_modes[self.preview_select.get()]
+            if mode is not None:
+                fixed_slice = np.take(self.data, layer, axis=dimension)
+                moving_slice = fuse_slices(fixed_slice, moving_slice, mode)
+            slice_data = np.rot90(moving_slice)
+        elif dimension == 0:
             slice_data = np.rot90(self.moving_data[layer, :, :])
         elif dimension == 1:
             slice_data = np.rot90(self.moving_data[:, layer, :])
@@ -420,30 +472,152 @@ class GUI(customtkinter.CTk):
         self.moving_canvas.draw()
 
     def apply_lineal_registration(self, *args):
-        fixed_image = sitk.GetImageFromArray(self.data)
-        moving_image = sitk.GetImageFromArray(self.moving_data)
-
-        method = sitk.ImageRegistrationMethod()
-        method.SetMetricAsMeanSquares()
-        method.SetInterpolator(sitk.sitkLinear)
-        method.SetOptimizerAsRegularStepGradientDescent(learningRate=0.1, minStep=1e-4, numberOfIterations=120)
-        method.SetOptimizerScalesFromIndexShift()
+        # Con el espaciado, el origen y la dirección del affine de NIfTI el
+        # registro se optimiza en milímetros y no en vóxeles.
+        fixed_image = nifti_to_sitk(self.data, self.nib_image.affine)
+        moving_image = nifti_to_sitk(self.moving_data, self.moving_affine)
+
+        preset = self.registration_presets[self.preset_select.get()]
+        stage = self.deformable_stages[self.deformable_select.get()]
+        if self.transform_cache is None:
+            self.transform_cache = TransformCache()
+
+        # El registro corre en otro hilo; las iteraciones llegan por la cola
+        # del monitor y la interfaz las lee sin bloquearse.
+        self.registration_monitor = RegistrationMonitor()
+        self.registration_result = None
+        self.registration_run = dict(
+            run=time.strftime("%Y-%m-%d %H:%M:%S"),
+            preset=preset,
+            deformable=stage,
+        )
+        self.registration_thread = threading.Thread(
+            target=self.registration_worker,
+            args=(fixed_image, moving_image, preset, stage),
+            daemon=True,
+        )
 
-        transformacion = sitk.AffineTransform(3)
-        initial_transform = sitk.CenteredTransformInitializer(fixed_image, moving_image, transformacion)
-        method.SetInitialTransform(initial_transform)
-        final_transform = method.Execute(fixed_image, moving_image)
+        self.progress_ax.clear()
+        self.progress_ax.set_xlabel("Iteración")
+        self.progress_ax.set_ylabel("Métrica")
+        self.progress_lines = {}
+        self.progress_canvas.draw()
+        self.register_lineal_button.configure(state="disabled")
+        self.cancel_register_button.configure(state="normal")
+
+        self.registration_thread.start()
+        self.after(100, self.poll_registration)
+
+    def registration_worker(self, fixed_image, moving_image, preset, stage):
+        monitor = self.registration_monitor
+        try:
+            # Volver a registrar el mismo par con los mismos parámetros sólo
+            # lee la transformación guardada y remuestrea.
+            final_transform, info = register_affine(
+                fixed_image,
+                moving_image,
+                preset,
+                cache=self.transform_cache,
+                monitor=monitor,
+            )
+            print("Métrica final: ", info["metric"])
+            print("Desde caché" if info["cached"] else info["stop_condition"])
+
+            # La etapa no lineal devuelve la afín compuesta con la
+            # deformación: el volumen se remuestrea una sola vez.
+            if stage == "bspline" and not monitor.cancelled:
+                final_transform, info = register_bspline(
+                    fixed_image, moving_image, final_transform, preset, monitor=monitor
+                )
+            elif stage == "demons" and not monitor.cancelled:
+                final_transform, info = register_demons(
+                    fixed_image, moving_image, final_transform, monitor=monitor
+                )
+
+            if monitor.cancelled:
+                self.registration_result = dict(cancelled=True)
+                return
+
+            # No se remuestrea el volumen: la vista previa remuestrea sólo el
+            # corte visible y el volumen completo se calcula al guardar.
+            self.registration_result = dict(
+                cancelled=False,
+                transform=final_transform,
+                fixed=fixed_image,
+                moving=moving_image,
+                info=info,
+            )
+        except Exception as error:
+            self.registration_result = dict(cancelled=False, error=error)
+
+    def poll_registration(self):
+        monitor = self.registration_monitor
+        updated = False
+        while not monitor.queue.empty():
+            record = monitor.queue.get()
+            if record["stage"] not in self.progress_lines:
+                (self.progress_lines[record["stage"]],) = self.progress_ax.plot(
+                    [], [], label=record["stage"]
+                )
+                self.progress_ax.legend(fontsize=6)
+            line = self.progress_lines[record["stage"]]
+            x, y = line.get_data()
+            line.set_data(np.append(x, len(x)), np.append(y, record["metric"]))
+            self.progress_label.configure(
+                text=f"{record['stage']} nivel {record['level']}, "
+                f"iteración {record['iteration']} ({record['seconds']:.1f} s)"
+            )
+            updated = True
+        if updated:
+            self.progress_ax.relim()
+            self.progress_ax.autoscale_view()
+            self.progress_canvas.draw_idle()
+
+        if self.registration_thread.is_alive():
+            self.after(100, self.poll_registration)
+            return
+
+        self.register_lineal_button.configure(state="normal")
+        self.cancel_register_button.configure(state="disabled")
+        # El log de iteraciones se acumula entre corridas para ajustar los
+        # parámetros del optimizador.
+        monitor.save("registro_iteraciones.csv", **self.registration_run)
+
+        result = self.registration_result
+        if result is None or "error" in result:
+            error = result["error"] if result else "sin resultado"
+            tkinter.messagebox.showerror("Error", f"Falló el registro: {error}")
+        elif result["cancelled"]:
+            self.progress_label.configure(text="Registro cancelado")
+        else:
+            self.moving_transform = result["transform"]
+            self.registration_fixed = result["fixed"]
+            self.registration_moving = result["moving"]
+            self.save_registered_button.configure(state="normal")
+            self.preview_select.configure(state="normal")
+            self.show_moving_image()
 
-        registered_image = sitk.Resample(moving_image, fixed_image, final_transform, sitk.sitkLinear, 0.0, moving_image.GetPixelID())
+    def save_registered_image(self):
+        # Único remuestreo del volumen completo, sobre la grilla fija.
+        registered_image = resample(
+            self.registration_moving, self.registration_fixed, self.moving_transform
+        )
+        data, affine = sitk_to_nifti(registered_image)
+        nibabel.save(nibabel.Nifti1Image(data, affine), "registered_image.nii")
 
-        self.moving_data = sitk.GetArrayFromImage(registered_image)
-        self.show_moving_image()
+    def cancel_registration(self):
+        if self.registration_monitor is not None:
+            self.registration_monitor.cancel()
 
     def register(self):
         self.no_registro()
 
         def reset_register():
-            self.moving_data = self.moving_image.get_fdata()
+            # La imagen móvil nunca se sobrescribe: basta con descartar la
+            # transformación.
+            self.moving_transform = None
+            self.save_registered_button.configure(state="disabled")
+            self.preview_select.configure(state="disabled")
             self.show_moving_image()
 
         self.registro_frame = customtkinter.CTkFrame(
@@ -497,6 +671,66 @@ class GUI(customtkinter.CTk):
         )
         self.register_lineal_button.grid(row=12, column=0, padx=20, pady=(10, 20))
 
+        self.registration_presets = {
+            "Balanceado": "balanced",
+            "Rápido": "fast",
+            "Preciso (información mutua)": "accurate",
+        }
+        self.preset_select = customtkinter.CTkOptionMenu(
+            self.registro_frame, values=list(self.registration_presets)
+        )
+        self.preset_select.grid(row=14, column=0, padx=20, pady=10)
+
+        self.deformable_stages = {
+            "Sin etapa no lineal": None,
+            "B-spline": "bspline",
+            "Demons": "demons",
+        }
+        self.deformable_select = customtkinter.CTkOptionMenu(
+            self.registro_frame, values=list(self.deformable_stages)
+        )
+        self.deformable_select.grid(row=15, column=0, padx=20, pady=10)
+
+        self.cancel_register_button = customtkinter.CTkButton(
+            self.registro_frame,
+            text="Cancelar registro",
+            command=self.cancel_registration,
+            state="disabled",
+        )
+        self.cancel_register_button.grid(row=16, column=0, padx=20, pady=(10, 20))
+
+        self.progress_label = customtkinter.CTkLabel(
+            self.registro_frame, text="", anchor="w"
+        )
+        self.progress_label.grid(row=17, column=0, padx=20, pady=(10, 0))
+
+        self.progress_canvas = FigureCanvasTkAgg(
+            matplotlib.pyplot.Figure(figsize=(3, 2)), master=self.registro_frame
+        )
+        self.progress_ax = self.progress_canvas.figure.add_subplot(111)
+        self.progress_canvas.get_tk_widget().grid(row=18, column=0, padx=20, pady=10)
+
+        self.preview_modes = {
+            "Móvil registrada": None,
+            "Tablero": "checkerboard",
+            "Mezcla": "blend",
+        }
+        self.preview_select = customtkinter.CTkOptionMenu(
+            self.registro_frame,
+            values=list(self.preview_modes),
+            command=self.show_moving_image,
+            state="disabled",
+        )
+        self.preview_select.grid(row=19, column=0, padx=20, pady=10)
+
+        self.save_registered_button = customtkinter.CTkButton(
+            self.registro_frame,
+            text="Guardar registrada",
+            command=self.save_registered_image,
+            state="disabled",
+        )
+        self.save_registered_button.grid(row=20, column=0, padx=20, pady=(10, 20))
+
         self.reset_register_button = customtkinter.CTkButton(
             self.registro_frame, text="Restaurar imagen", command=reset_register, state="disabled"
         )
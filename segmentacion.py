@@ -1,17 +1,687 @@
 from PIL import Image
+import csv
 import tkinter
 import tkinter.messagebox
 import customtkinter
 import nibabel
 import numpy
 import matplotlib.pyplot
+from scipy import ndimage
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor
+import os
+from registro import magnitud_gradiente
+from laplacian_coordinates import (
+    conjugate_gradient,
+    grid_apply_laplacian,
+    grid_degree,
+)
 
 customtkinter.set_appearance_mode("Dark")
 customtkinter.set_default_color_theme("green")
 
 
+def kmeans_histograma(data, clusters, iterations, bins=512, tol=1e-3, seed=None):
+    # K-means 1D sobre el histograma ponderado de intensidades: cada iteración
+    # cuesta O(bins * clusters) en lugar de recorrer todo el volumen.
+    counts, edges = numpy.histogram(data, bins=bins)
+    values = ((edges[:-1] + edges[1:]) / 2)[counts > 0]
+    weights = counts[counts > 0].astype(numpy.float64)
+
+    if clusters >= len(values):
+        centers = numpy.sort(values)
+    else:
+        # Semillas k-means++ sobre los bins del histograma
+        rng = numpy.random.default_rng(seed)
+        centers = [values[rng.choice(len(values), p=weights / weights.sum())]]
+        for _ in range(1, clusters):
+            d2 = numpy.min(
+                (values[:, None] - numpy.array(centers)[None, :]) ** 2, axis=1
+            )
+            p = weights * d2
+            if p.sum() == 0:
+                break
+            centers.append(values[rng.choice(len(values), p=p / p.sum())])
+        centers = numpy.sort(numpy.array(centers))
+
+    span = max(edges[-1] - edges[0], 1e-12)
+    for i in range(iterations):
+        midpoints = (centers[:-1] + centers[1:]) / 2
+        assignment = numpy.searchsorted(midpoints, values)
+        sums = numpy.bincount(assignment, weights * values, minlength=len(centers))
+        totals = numpy.bincount(assignment, weights, minlength=len(centers))
+        new_centers = numpy.sort(
+            numpy.where(totals > 0, sums / numpy.maximum(totals, 1e-12), centers)
+        )
+        shift = numpy.max(numpy.abs(new_centers - centers))
+        centers = new_centers
+        if shift <= tol * span:
+            break
+
+    midpoints = (centers[:-1] + centers[1:]) / 2
+    labels = numpy.searchsorted(midpoints, data).astype(numpy.uint8)
+
+    return labels, centers
+
+
+def caracteristicas_voxel(data, extra, start, stop):
+    # Intensidad, media local, magnitud del gradiente y modalidades extra para
+    # las capas [start, stop) del eje 0. Se usa un halo de una capa para que
+    # los filtros 3x3x3 den el mismo resultado que sobre el volumen completo.
+    lo = max(start - 1, 0)
+    hi = min(stop + 1, data.shape[0])
+    block = numpy.asarray(data[lo:hi], dtype=numpy.float32)
+    crop = slice(start - lo, start - lo + stop - start)
+
+    local_mean = ndimage.uniform_filter(block, size=3)
+    gradient = numpy.zeros_like(block)
+    for axis in range(block.ndim):
+        gradient += ndimage.sobel(block, axis) ** 2
+    numpy.sqrt(gradient, out=gradient)
+
+    features = [block[crop], local_mean[crop], gradient[crop]]
+    for volume in extra:
+        features.append(numpy.asarray(volume[start:stop], dtype=numpy.float32))
+
+    return numpy.stack([f.ravel() for f in features], axis=1)
+
+
+def kmeans_minibatch(
+    data,
+    clusters,
+    iterations,
+    extra=(),
+    batch_size=2048,
+    sample_size=100000,
+    slab=8,
+    tol=1e-4,
+    seed=None,
+):
+    # K-means mini-batch sobre vectores de características. El volumen se
+    # recorre por bloques de capas: una pasada para muestrear el foreground y
+    # otra para asignar etiquetas, así la memoria no depende del número de
+    # características por vóxel.
+    rng = numpy.random.default_rng(seed)
+    threshold = numpy.min(data)
+    foreground_count = numpy.count_nonzero(data > threshold)
+    if foreground_count == 0:
+        return numpy.zeros(data.shape, dtype=numpy.uint8), None
+    rate = min(1.0, sample_size / foreground_count)
+
+    samples = []
+    for start in range(0, data.shape[0], slab):
+        stop = min(start + slab, data.shape[0])
+        foreground = (data[start:stop] > threshold).ravel()
+        pick = foreground & (rng.random(foreground.shape) < rate)
+        if numpy.any(pick):
+            samples.append(caracteristicas_voxel(data, extra, start, stop)[pick])
+    samples = numpy.concatenate(samples)
+
+    mean = samples.mean(axis=0)
+    std = samples.std(axis=0)
+    std[std == 0] = 1
+    samples = (samples - mean) / std
+
+    # Semillas k-means++ sobre la muestra
+    centers = [samples[rng.integers(len(samples))]]
+    d2 = numpy.sum((samples - centers[0]) ** 2, axis=1)
+    for _ in range(1, clusters):
+        if d2.sum() == 0:
+            break
+        centers.append(samples[rng.choice(len(samples), p=d2 / d2.sum())])
+        d2 = numpy.minimum(d2, numpy.sum((samples - centers[-1]) ** 2, axis=1))
+    centers = numpy.array(centers)
+    counts = numpy.zeros(len(centers))
+
+    for i in range(iterations):
+        batch = samples[rng.integers(len(samples), size=batch_size)]
+        nearest = numpy.argmin(
+            ((batch[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2), axis=1
+        )
+        previous = centers.copy()
+        for cluster_idx in range(len(centers)):
+            members = batch[nearest == cluster_idx]
+            if len(members) == 0:
+                continue
+            counts[cluster_idx] += len(members)
+            eta = len(members) / counts[cluster_idx]
+            centers[cluster_idx] += eta * (members.mean(axis=0) - centers[cluster_idx])
+        if numpy.max(numpy.abs(centers - previous)) <= tol:
+            break
+
+    # Etiquetas ordenadas por intensidad; 0 queda para el fondo
+    order = numpy.argsort(centers[:, 0])
+    centers = centers[order]
+
+    labels = numpy.zeros(data.shape, dtype=numpy.uint8)
+    for start in range(0, data.shape[0], slab):
+        stop = min(start + slab, data.shape[0])
+        features = (caracteristicas_voxel(data, extra, start, stop) - mean) / std
+        distances = ((features[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        chunk = (numpy.argmin(distances, axis=1) + 1).astype(numpy.uint8)
+        chunk[(data[start:stop] <= threshold).ravel()] = 0
+        labels[start:stop] = chunk.reshape(labels[start:stop].shape)
+
+    return labels, centers * std + mean
+
+
+def gmm_histograma(data, classes, iterations, bins=512, tol=1e-6, dtype=numpy.uint8):
+    # Mezcla de gaussianas ajustada con EM sobre el histograma de
+    # intensidades: el costo depende del número de bins y no de vóxeles.
+    counts, edges = numpy.histogram(data, bins=bins)
+    values = (edges[:-1] + edges[1:]) / 2
+    weights = counts.astype(numpy.float64)
+    total = weights.sum()
+
+    # Inicialización por cuantiles del histograma
+    cumulative = numpy.cumsum(weights) / total
+    quantiles = (numpy.arange(classes) + 0.5) / classes
+    means = values[numpy.minimum(numpy.searchsorted(cumulative, quantiles), bins - 1)]
+    global_mean = numpy.sum(weights * values) / total
+    global_var = numpy.sum(weights * (values - global_mean) ** 2) / total
+    variances = numpy.full(classes, max(global_var / classes**2, 1e-6))
+    priors = numpy.full(classes, 1.0 / classes)
+    min_var = ((edges[1] - edges[0]) / 2) ** 2
+
+    def responsibilities():
+        log_p = (
+            numpy.log(priors)
+            - 0.5 * numpy.log(2 * numpy.pi * variances)
+            - 0.5 * (values[:, None] - means) ** 2 / variances
+        )
+        log_norm = numpy.logaddexp.reduce(log_p, axis=1)
+        return numpy.exp(log_p - log_norm[:, None]), log_norm
+
+    previous = -numpy.inf
+    for i in range(iterations):
+        resp, log_norm = responsibilities()
+        likelihood = numpy.sum(weights * log_norm) / total
+
+        nk = numpy.maximum((weights[:, None] * resp).sum(axis=0), 1e-12)
+        means = (weights[:, None] * resp * values[:, None]).sum(axis=0) / nk
+        variances = numpy.maximum(
+            (weights[:, None] * resp * (values[:, None] - means) ** 2).sum(axis=0) / nk,
+            min_var,
+        )
+        priors = nk / nk.sum()
+
+        if abs(likelihood - previous) <= tol * abs(likelihood):
+            break
+        previous = likelihood
+
+    order = numpy.argsort(means)
+    means, variances, priors = means[order], variances[order], priors[order]
+    resp, _ = responsibilities()
+
+    # Una sola pasada vectorizada: índice de bin por vóxel y tabla de
+    # posteriores por bin.
+    width = edges[1] - edges[0]
+    if width > 0:
+        bin_idx = ((numpy.asarray(data) - edges[0]) / width).astype(numpy.intp)
+        numpy.clip(bin_idx, 0, bins - 1, out=bin_idx)
+    else:
+        bin_idx = numpy.zeros(numpy.shape(data), dtype=numpy.intp)
+
+    labels = numpy.argmax(resp, axis=1).astype(numpy.uint8)[bin_idx]
+    if numpy.dtype(dtype) == numpy.uint8:
+        table = numpy.round(resp * 255).astype(numpy.uint8)
+    else:
+        table = resp.astype(dtype)
+    posteriors = numpy.moveaxis(table[bin_idx], -1, 0)
+
+    return labels, posteriors, means, variances, priors
+
+
+def etiquetar_componentes(mask, connectivity=6):
+    if connectivity == 26:
+        structure = numpy.ones((3, 3, 3), dtype=bool)
+    else:
+        structure = ndimage.generate_binary_structure(mask.ndim, 1)
+    labels, count = ndimage.label(mask, structure=structure)
+    return labels, count
+
+
+def estadisticas_componentes(labels, count, data, affine=None):
+    # Todas las estadísticas salen de reducciones tipo bincount sobre el
+    # volumen de etiquetas; no se construye una máscara por componente.
+    flat = labels.ravel()
+    voxels = numpy.bincount(flat, minlength=count + 1)
+    safe = numpy.maximum(voxels, 1)
+
+    centroid = numpy.zeros((count + 1, labels.ndim))
+    for axis in range(labels.ndim):
+        shape = [1] * labels.ndim
+        shape[axis] = labels.shape[axis]
+        coords = numpy.broadcast_to(
+            numpy.arange(labels.shape[axis]).reshape(shape), labels.shape
+        )
+        centroid[:, axis] = (
+            numpy.bincount(flat, weights=coords.ravel(), minlength=count + 1) / safe
+        )
+
+    mean_intensity = (
+        numpy.bincount(flat, weights=numpy.ravel(data), minlength=count + 1) / safe
+    )
+
+    bbox = numpy.zeros((count + 1, 2 * labels.ndim), dtype=numpy.int64)
+    for idx, box in enumerate(ndimage.find_objects(labels, max_label=count)):
+        if box is not None:
+            bbox[idx + 1] = [b.start for b in box] + [b.stop for b in box]
+
+    voxel_volume = 1.0
+    if affine is not None:
+        voxel_volume = abs(numpy.linalg.det(numpy.asarray(affine)[:3, :3]))
+
+    return {
+        "label": numpy.arange(1, count + 1),
+        "voxels": voxels[1:],
+        "volume_mm3": voxels[1:] * voxel_volume,
+        "centroid": centroid[1:],
+        "bbox": bbox[1:],
+        "mean_intensity": mean_intensity[1:],
+    }
+
+
+def guardar_estadisticas(stats, path):
+    # Una fila por componente; centroide y caja en columnas separadas para
+    # poder abrir el archivo directamente en una planilla.
+    ndim = stats["centroid"].shape[1]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["label", "voxels", "volume_mm3"]
+            + [f"centroid_{axis}" for axis in range(ndim)]
+            + [f"bbox_start_{axis}" for axis in range(ndim)]
+            + [f"bbox_stop_{axis}" for axis in range(ndim)]
+            + ["mean_intensity"]
+        )
+        for k in range(len(stats["label"])):
+            writer.writerow(
+                [stats["label"][k], stats["voxels"][k], stats["volume_mm3"][k]]
+                + stats["centroid"][k].tolist()
+                + stats["bbox"][k].tolist()
+                + [stats["mean_intensity"][k]]
+            )
+
+
+def conservar_mayor_componente(labels, count):
+    if count == 0:
+        return labels > 0
+    voxels = numpy.bincount(labels.ravel(), minlength=count + 1)
+    voxels[0] = 0
+    return labels == numpy.argmax(voxels)
+
+
+def eliminar_componentes_pequenas(labels, count, min_voxels):
+    voxels = numpy.bincount(labels.ravel(), minlength=count + 1)
+    keep = voxels >= min_voxels
+    keep[0] = False
+    return keep[labels]
+
+
+def procesar_por_bloques(func, mask, halo, slab=32):
+    # Aplica func sobre bloques de capas del eje 0 con un halo de `halo`
+    # capas, de forma que cada bloque da el mismo resultado que el volumen
+    # completo. Los bloques se reparten entre hilos.
+    mask = numpy.asarray(mask, dtype=bool)
+    result = numpy.empty(mask.shape, dtype=bool)
+    halo = int(numpy.ceil(halo))
+
+    def block(start):
+        stop = min(start + slab, mask.shape[0])
+        lo = max(start - halo, 0)
+        hi = min(stop + halo, mask.shape[0])
+        result[start:stop] = func(mask[lo:hi])[start - lo : start - lo + stop - start]
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(block, range(0, mask.shape[0], slab)))
+
+    return result
+
+
+def distancia_a_cero(mask):
+    if mask.all():
+        return numpy.full(mask.shape, numpy.inf)
+    return ndimage.distance_transform_edt(mask)
+
+
+# Hasta este radio la esfera tiene pocos vóxeles y binary_dilation con ese
+# elemento estructurante es más rápido que una transformada de distancia
+# completa; para esferas más grandes la EDT gana porque no depende del radio.
+RADIO_BOLA = 2
+
+
+def bola(radius, ndim=3):
+    offsets = numpy.mgrid[(slice(-radius, radius + 1),) * ndim]
+    return (offsets**2).sum(axis=0) <= radius**2
+
+
+def dilatar(mask, radius):
+    # Dilatación por una esfera de radio `radius`: con la bola para radios
+    # chicos y umbralizando la transformada de distancia para los grandes.
+    if radius <= RADIO_BOLA:
+        ball = bola(radius, numpy.ndim(mask))
+        return procesar_por_bloques(
+            lambda m: ndimage.binary_dilation(m, ball), mask, radius
+        )
+    return procesar_por_bloques(lambda m: distancia_a_cero(~m) <= radius, mask, radius)
+
+
+def erosionar(mask, radius):
+    # Fuera del volumen no hay fondo, igual que para la EDT: border_value=1.
+    if radius <= RADIO_BOLA:
+        ball = bola(radius, numpy.ndim(mask))
+        return procesar_por_bloques(
+            lambda m: ndimage.binary_erosion(m, ball, border_value=1), mask, radius
+        )
+    return procesar_por_bloques(lambda m: distancia_a_cero(m) > radius, mask, radius)
+
+
+def apertura(mask, radius):
+    return dilatar(erosionar(mask, radius), radius)
+
+
+def cierre(mask, radius):
+    return erosionar(dilatar(mask, radius), radius)
+
+
+def rellenar_huecos(mask):
+    return ndimage.binary_fill_holes(numpy.asarray(mask, dtype=bool))
+
+
+def voxel_desde_pantalla(x, y, dimension, layer, shape):
+    # Las capas se muestran con numpy.rot90, así que el punto (x, y) de la
+    # figura corresponde a la fila x y la columna (ancho - 1 - y) del corte.
+    if dimension == 0:
+        return layer, x, shape[2] - 1 - y
+    elif dimension == 1:
+        return x, layer, shape[2] - 1 - y
+    return x, shape[1] - 1 - y, layer
+
+
+def semillas_trazos(drawn_objects_dict, shape, color):
+    # Índices planos de los vóxeles cubiertos por los círculos del color
+    # indicado, en cualquier capa de cualquiera de las tres dimensiones.
+    rgba = matplotlib.colors.to_rgba(color)
+    indices = []
+    for dimension, layers in drawn_objects_dict.items():
+        for layer, circles in layers.items():
+            for circle in circles:
+                if tuple(circle.get_facecolor()) != rgba:
+                    continue
+                cx, cy = circle.center
+                r = int(numpy.ceil(circle.radius))
+                dx, dy = numpy.mgrid[-r : r + 1, -r : r + 1]
+                inside = dx**2 + dy**2 <= circle.radius**2
+                xs = (cx + dx[inside]).astype(numpy.intp)
+                ys = (cy + dy[inside]).astype(numpy.intp)
+                voxel = voxel_desde_pantalla(xs, ys, dimension, layer, shape)
+                voxel = [numpy.broadcast_to(v, xs.shape) for v in voxel]
+                valid = numpy.ones(xs.shape, dtype=bool)
+                for axis, v in enumerate(voxel):
+                    valid &= (v >= 0) & (v < shape[axis])
+                indices.append(
+                    numpy.ravel_multi_index([v[valid] for v in voxel], shape)
+                )
+    if not indices:
+        return numpy.zeros(0, dtype=numpy.intp)
+    return numpy.unique(numpy.concatenate(indices))
+
+
+def pesos_grilla(data, beta=90.0, epsilon=1e-6):
+    # Pesos gaussianos de las aristas del grafo 6-conexo, uno por eje, en
+    # float32: w = exp(-beta * (g_i - g_j)^2) con g normalizada a [0, 1].
+    g = numpy.asarray(data, dtype=numpy.float32)
+    g = (g - g.min()) / max(float(g.max() - g.min()), 1e-12)
+    weights = []
+    for axis in range(g.ndim):
+        d = numpy.diff(g, axis=axis)
+        weights.append(numpy.exp(-beta * d * d) + numpy.float32(epsilon))
+    return weights
+
+
+def random_walker(data, foreground, background, beta=90.0, tol=1e-3, maxiter=500, levels=2):
+    # Probabilidad de que un caminante aleatorio que parte de cada vóxel
+    # llegue primero a una semilla de foreground. Se resuelve
+    # L_UU x_U = -L_UM x_M sin formar la matriz y con una cascada de
+    # resoluciones: la solución del nivel grueso inicializa el fino. Si el
+    # gradiente conjugado no converge se lanza RuntimeError en lugar de
+    # devolver probabilidades a medio calcular.
+    shape = numpy.shape(data)
+    weights = pesos_grilla(data, beta)
+
+    seeds = numpy.zeros(shape, dtype=bool)
+    values = numpy.zeros(shape, dtype=numpy.float32)
+    seeds.flat[foreground] = True
+    seeds.flat[background] = True
+    values.flat[foreground] = 1
+    unknown = ~seeds
+
+    def apply_A(v):
+        return numpy.where(unknown, grid_apply_laplacian(weights, v * unknown), v)
+
+    b = numpy.where(unknown, -grid_apply_laplacian(weights, values), values)
+    diagonal = numpy.where(unknown, grid_degree(weights, shape), 1).astype(
+        numpy.float32
+    )
+
+    x0 = numpy.full(shape, 0.5, dtype=numpy.float32)
+    if levels > 0 and min(shape) >= 16:
+        coarse = numpy.asarray(data)[::2, ::2, ::2]
+        coarse_index = lambda idx: numpy.ravel_multi_index(
+            [c // 2 for c in numpy.unravel_index(idx, shape)], coarse.shape
+        )
+        coarse_x = random_walker(
+            coarse,
+            coarse_index(foreground),
+            coarse_index(background),
+            beta,
+            tol,
+            maxiter,
+            levels - 1,
+        )
+        x0 = ndimage.zoom(
+            coarse_x, [n / c for n, c in zip(shape, coarse.shape)], order=1
+        )[: shape[0], : shape[1], : shape[2]]
+    x0 = numpy.where(seeds, values, x0)
+
+    x, iterations, converged = conjugate_gradient(
+        apply_A, b, x0, lambda r: r / diagonal, tol, maxiter
+    )
+    if not converged:
+        raise RuntimeError(
+            f"El gradiente conjugado no convergió en {iterations} iteraciones"
+        )
+    return x
+
+
+def distancia_con_signo(inside, band):
+    # Función de distancia con signo (positiva adentro) truncada a +-band.
+    # Sólo se calcula en la caja que rodea la interfaz más un margen.
+    phi = numpy.where(inside, numpy.float32(band), numpy.float32(-band))
+    interface = inside ^ ndimage.binary_erosion(inside, border_value=1)
+    if not interface.any():
+        return phi
+    margin = int(numpy.ceil(band)) + 1
+    box = tuple(
+        slice(max(int(idx.min()) - margin, 0), int(idx.max()) + margin + 1)
+        for idx in numpy.nonzero(interface)
+    )
+    crop = inside[box]
+    d_in = distancia_a_cero(crop)
+    d_out = distancia_a_cero(~crop)
+    phi[box] = numpy.clip(
+        numpy.where(crop, d_in - 0.5, 0.5 - d_out), -band, band
+    ).astype(numpy.float32)
+    return phi
+
+
+def chan_vese(
+    data,
+    initial_mask,
+    iterations=200,
+    mu=0.2,
+    lambda1=1.0,
+    lambda2=1.0,
+    band=4.0,
+    dt=0.5,
+    reinit_every=10,
+):
+    # Chan-Vese con banda estrecha: en cada iteración sólo se actualizan los
+    # vóxeles con |phi| < band y las medias de adentro/afuera se corrigen con
+    # los vóxeles que cambian de signo, así el costo escala con la superficie.
+    image = numpy.asarray(data, dtype=numpy.float32)
+    image = (image - image.min()) / max(float(image.max() - image.min()), 1e-12)
+    flat_image = image.ravel()
+    shape = image.shape
+    ndim = image.ndim
+
+    phi = distancia_con_signo(numpy.asarray(initial_mask, dtype=bool), band)
+    flat_phi = phi.ravel()
+    inside = flat_phi > 0
+    sum_in = float(flat_image[inside].sum())
+    n_in = int(inside.sum())
+    sum_all = float(flat_image.sum())
+    n_all = flat_image.size
+
+    def neighbor(coords, offsets):
+        moved = [
+            numpy.clip(c + o, 0, n - 1) for c, o, n in zip(coords, offsets, shape)
+        ]
+        return numpy.ravel_multi_index(moved, shape)
+
+    def build_band():
+        idx = numpy.flatnonzero(numpy.abs(flat_phi) < band)
+        coords = numpy.unravel_index(idx, shape)
+        unit = numpy.eye(ndim, dtype=numpy.intp)
+        plus = [neighbor(coords, unit[a]) for a in range(ndim)]
+        minus = [neighbor(coords, -unit[a]) for a in range(ndim)]
+        cross = {}
+        for a in range(ndim):
+            for b in range(a + 1, ndim):
+                cross[a, b] = [
+                    neighbor(coords, unit[a] * sa + unit[b] * sb)
+                    for sa, sb in ((1, 1), (1, -1), (-1, 1), (-1, -1))
+                ]
+        return idx, plus, minus, cross
+
+    idx, plus, minus, cross = build_band()
+    for i in range(iterations):
+        if i > 0 and i % reinit_every == 0:
+            phi = distancia_con_signo(flat_phi.reshape(shape) > 0, band)
+            flat_phi = phi.ravel()
+            idx, plus, minus, cross = build_band()
+        if len(idx) == 0:
+            break
+
+        center = flat_phi[idx]
+        first = [(flat_phi[plus[a]] - flat_phi[minus[a]]) / 2 for a in range(ndim)]
+        second = [
+            flat_phi[plus[a]] - 2 * center + flat_phi[minus[a]] for a in range(ndim)
+        ]
+        grad2 = sum(f * f for f in first) + 1e-8
+        numerator = sum(second) * grad2 - sum(
+            f * f * d for f, d in zip(first, second)
+        )
+        for (a, b), (pp, pm, mp, mm) in cross.items():
+            mixed = (flat_phi[pp] - flat_phi[pm] - flat_phi[mp] + flat_phi[mm]) / 4
+            numerator -= 2 * first[a] * first[b] * mixed
+        curvature = numerator / grad2**1.5
+
+        c1 = sum_in / max(n_in, 1)
+        c2 = (sum_all - sum_in) / max(n_all - n_in, 1)
+        values = flat_image[idx]
+        force = (
+            mu * curvature
+            - lambda1 * (values - c1) ** 2
+            + lambda2 * (values - c2) ** 2
+        )
+        force /= max(float(numpy.max(numpy.abs(force))), 1e-12)
+
+        updated = numpy.clip(center + dt * force, -band, band)
+        flipped = (updated > 0) != (center > 0)
+        if numpy.any(flipped):
+            entering = idx[flipped & (updated > 0)]
+            leaving = idx[flipped & (updated <= 0)]
+            sum_in += float(flat_image[entering].sum() - flat_image[leaving].sum())
+            n_in += len(entering) - len(leaving)
+        flat_phi[idx] = updated
+
+    return (flat_phi.reshape(shape) > 0).astype(numpy.uint8)
+
+
+def vecinos_grilla(idx, shape):
+    # Vecinos 6-conexos (en 3D) de un arreglo de índices planos, sin salir
+    # del volumen.
+    coords = numpy.unravel_index(idx, shape)
+    strides = numpy.cumprod((1,) + tuple(shape[:0:-1]))[::-1]
+    neighbors = []
+    for axis, n in enumerate(shape):
+        c = coords[axis]
+        neighbors.append(idx[c > 0] - strides[axis])
+        neighbors.append(idx[c < n - 1] + strides[axis])
+    return numpy.concatenate(neighbors)
+
+
+def watershed_marcadores(gradient, markers, levels=256):
+    # Inundación de Meyer con una cola de prioridad por cubetas sobre el
+    # gradiente cuantizado: cada vóxel entra una sola vez a la cola y cada
+    # cubeta se procesa por lotes vectorizados, así el costo es O(N).
+    shape = numpy.shape(gradient)
+    g = numpy.asarray(gradient, dtype=numpy.float64)
+    span = max(float(g.max() - g.min()), 1e-12)
+    quantized = numpy.minimum(
+        ((g - g.min()) / span * (levels - 1)).round(), levels - 1
+    ).astype(numpy.int32).ravel()
+
+    # Los vóxeles se agrupan por nivel una sola vez (el argsort estable de
+    # enteros de 16 bits es un radix sort, y los límites de cada grupo salen
+    # de bincount): los lotes no se ordenan al encolarlos, y la cubeta de
+    # cada nivel se arma al llegar a él con los vóxeles ya encolados.
+    by_level = numpy.argsort(quantized.astype(numpy.uint16), kind="stable")
+    starts = numpy.concatenate(
+        ([0], numpy.cumsum(numpy.bincount(quantized, minlength=levels)))
+    )
+
+    strides = numpy.cumprod((1,) + tuple(shape[:0:-1]))[::-1]
+    labels = numpy.asarray(markers).astype(numpy.int32).ravel()
+    queued = labels > 0
+
+    def push(sources, level):
+        # Marca los vecinos nuevos como encolados y devuelve los que se
+        # inundan en este mismo nivel; los de niveles más altos esperan.
+        neighbors = vecinos_grilla(sources, shape)
+        neighbors = neighbors[~queued[neighbors]]
+        # Un vecino compartido por varias fuentes aparece repetido: su
+        # etiqueta (todavía 0) guarda la posición de una de sus apariciones
+        # y sólo esa se conserva.
+        position = numpy.arange(1, len(neighbors) + 1, dtype=numpy.int32)
+        labels[neighbors] = position
+        neighbors = neighbors[labels[neighbors] == position]
+        labels[neighbors] = 0
+        queued[neighbors] = True
+        return neighbors[quantized[neighbors] <= level]
+
+    push(numpy.flatnonzero(labels > 0), -1)
+    for level in range(levels):
+        members = by_level[starts[level] : starts[level + 1]]
+        current = members[queued[members] & (labels[members] == 0)]
+        while len(current):
+            # Cada vóxel toma la etiqueta de un vecino ya inundado
+            coords = numpy.unravel_index(current, shape)
+            assigned = numpy.zeros(len(current), dtype=numpy.int32)
+            for axis, n in enumerate(shape):
+                for step, valid in ((-1, coords[axis] > 0), (1, coords[axis] < n - 1)):
+                    pending = valid & (assigned == 0)
+                    neighbor = current[pending] + step * strides[axis]
+                    assigned[pending] = labels[neighbor]
+            labels[current] = assigned
+            current = push(current, level)
+
+    return labels.reshape(shape)
+
+
 class GUI(customtkinter.CTk):
     def __init__(self):
         super().__init__()
@@ -41,6 +711,7 @@ class GUI(customtkinter.CTk):
         self.current_color = self.colors[0][0]
         self.brush_size = 3
         self.drawn_objects_dict = {}
+        self.extra_modalities = []
 
         self.setup_menu()
 
@@ -136,6 +807,13 @@ class GUI(customtkinter.CTk):
                 "Isodata",
                 "Crecimiento de regiones",
                 "K-means",
+                "K-means multicaracterística",
+                "GMM (EM)",
+                "Componentes conexas",
+                "Morfología",
+                "Random walker 3D",
+                "Chan-Vese",
+                "Watershed",
             ],
             command=self.thresholding_menu,
         )
@@ -325,6 +1003,20 @@ class GUI(customtkinter.CTk):
             self.crecimiento_regiones()
         elif self.umbralizacion_select.get() == "K-means":
             self.kmeans()
+        elif self.umbralizacion_select.get() == "K-means multicaracterística":
+            self.kmeans_multicaracteristica()
+        elif self.umbralizacion_select.get() == "GMM (EM)":
+            self.gmm()
+        elif self.umbralizacion_select.get() == "Componentes conexas":
+            self.componentes_conexas()
+        elif self.umbralizacion_select.get() == "Morfología":
+            self.morfologia()
+        elif self.umbralizacion_select.get() == "Random walker 3D":
+            self.random_walker()
+        elif self.umbralizacion_select.get() == "Chan-Vese":
+            self.chan_vese()
+        elif self.umbralizacion_select.get() == "Watershed":
+            self.watershed()
 
     def no_threshold(self):
         if hasattr(self, "threshold_frame"):
@@ -502,24 +1194,13 @@ class GUI(customtkinter.CTk):
 
     def kmeans(self):
         def kmeans(*args):
-            data = self.data.copy()
             clusters = int(self.cluster_input.get())
             iterations = int(self.iterations_input.get())
 
-            cluster_values = numpy.linspace(
-                numpy.amin(data), numpy.amax(data), clusters
+            segmented, cluster_values = kmeans_histograma(
+                self.data, clusters, iterations
             )
 
-            for i in range(iterations):
-                distances = [numpy.abs(cluster - data) for cluster in cluster_values]
-
-                segmented = numpy.argmin(distances, axis=0)
-
-                for cluster_idx in range(clusters):
-                    cluster_values[cluster_idx] = numpy.mean(
-                        data[segmented == cluster_idx]
-                    )
-
             self.modified_data = segmented
 
             self.update_image()
@@ -579,6 +1260,558 @@ class GUI(customtkinter.CTk):
         )
         self.kmeans_button.grid(row=5, column=0, padx=20, pady=(10, 20))
 
+    def kmeans_multicaracteristica(self):
+        def kmeans(*args):
+            clusters = int(self.cluster_input.get())
+            iterations = int(self.iterations_input.get())
+
+            segmented, cluster_values = kmeans_minibatch(
+                self.data, clusters, iterations, extra=self.extra_modalities
+            )
+
+            self.modified_data = segmented
+
+            self.update_image()
+
+        def load_modality(*args):
+            file_path = customtkinter.filedialog.askopenfilename(
+                filetypes=[("NIfTI files", "*.nii")]
+            )
+            if not file_path:
+                return
+            modality = nibabel.load(file_path).get_fdata(dtype=numpy.float32)
+            if modality.shape != self.file_shape:
+                tkinter.messagebox.showerror(
+                    "Error",
+                    "La modalidad debe estar registrada al volumen actual "
+                    "(mismas dimensiones).",
+                )
+                return
+            self.extra_modalities.append(modality)
+            self.modalities_label.configure(
+                text=f"Modalidades extra: {len(self.extra_modalities)}"
+            )
+
+        def update_label(*args):
+            self.cluster_label.configure(
+                text=f"Número de clusters: {int(self.cluster_input.get())}"
+            )
+
+        def update_iterations_label(*args):
+            self.iterations_label.configure(
+                text=f"Iteraciones: {int(self.iterations_input.get())}"
+            )
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="K-means mini-batch",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.cluster_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Número de clusters: 3", anchor="w"
+        )
+        self.cluster_label.grid(row=1, column=0, padx=20, pady=(10, 0))
+
+        self.cluster_input = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=2,
+            to=10,
+            number_of_steps=8,
+            command=update_label,
+        )
+        self.cluster_input.set(3)
+        self.cluster_input.grid(row=2, column=0, padx=20, pady=(10, 0))
+
+        self.iterations_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Iteraciones: 100", anchor="w"
+        )
+        self.iterations_label.grid(row=3, column=0, padx=20, pady=(10, 0))
+        self.iterations_input = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=10,
+            to=500,
+            number_of_steps=49,
+            command=update_iterations_label,
+        )
+        self.iterations_input.set(100)
+        self.iterations_input.grid(row=4, column=0, padx=20, pady=(10, 0))
+
+        self.modalities_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text=f"Modalidades extra: {len(self.extra_modalities)}",
+            anchor="w",
+        )
+        self.modalities_label.grid(row=5, column=0, padx=20, pady=(10, 0))
+
+        self.modality_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Cargar modalidad", command=load_modality
+        )
+        self.modality_button.grid(row=6, column=0, padx=20, pady=(10, 0))
+
+        self.kmeans_button = customtkinter.CTkButton(
+            self.threshold_frame, text="K-means", command=kmeans
+        )
+        self.kmeans_button.grid(row=7, column=0, padx=20, pady=(10, 20))
+
+    def gmm(self):
+        def gmm(*args):
+            classes = int(self.classes_input.get())
+            iterations = int(self.iterations_input.get())
+
+            labels, posteriors, means, variances, priors = gmm_histograma(
+                self.data, classes, iterations
+            )
+            self.gmm_labels = labels
+            self.posterior_maps = posteriors
+
+            self.posterior_select.configure(
+                values=["Etiquetas"]
+                + [f"Probabilidad clase {k + 1}" for k in range(classes)],
+                state="normal",
+            )
+            self.posterior_select.set("Etiquetas")
+            show_map()
+
+        def show_map(*args):
+            selected = self.posterior_select.get()
+            if selected == "Etiquetas":
+                self.modified_data = self.gmm_labels
+            else:
+                self.modified_data = self.posterior_maps[int(selected.split()[-1]) - 1]
+            self.update_image()
+
+        def update_classes_label(*args):
+            self.classes_label.configure(
+                text=f"Número de clases: {int(self.classes_input.get())}"
+            )
+
+        def update_iterations_label(*args):
+            self.iterations_label.configure(
+                text=f"Iteraciones: {int(self.iterations_input.get())}"
+            )
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="GMM (EM)",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.classes_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Número de clases: 3", anchor="w"
+        )
+        self.classes_label.grid(row=1, column=0, padx=20, pady=(10, 0))
+
+        self.classes_input = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=2,
+            to=6,
+            number_of_steps=4,
+            command=update_classes_label,
+        )
+        self.classes_input.set(3)
+        self.classes_input.grid(row=2, column=0, padx=20, pady=(10, 0))
+
+        self.iterations_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Iteraciones: 100", anchor="w"
+        )
+        self.iterations_label.grid(row=3, column=0, padx=20, pady=(10, 0))
+        self.iterations_input = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=10,
+            to=500,
+            number_of_steps=49,
+            command=update_iterations_label,
+        )
+        self.iterations_input.set(100)
+        self.iterations_input.grid(row=4, column=0, padx=20, pady=(10, 0))
+
+        self.gmm_button = customtkinter.CTkButton(
+            self.threshold_frame, text="GMM", command=gmm
+        )
+        self.gmm_button.grid(row=5, column=0, padx=20, pady=(10, 20))
+
+        self.posterior_select = customtkinter.CTkOptionMenu(
+            self.threshold_frame,
+            state="disabled",
+            values=["Etiquetas"],
+            command=show_map,
+        )
+        self.posterior_select.grid(row=6, column=0, padx=20, pady=10)
+
+    def componentes_conexas(self):
+        def connectivity():
+            return 26 if self.connectivity_select.get() == "26 vecinos" else 6
+
+        def etiquetar(*args):
+            labels, count = etiquetar_componentes(self.modified_data > 0, connectivity())
+            stats = estadisticas_componentes(
+                labels, count, self.data, self.nib_image.affine
+            )
+
+            # La tabla completa (con centroides y cajas) va al CSV, junto a
+            # modified_image.nii; en el panel se resume cada componente.
+            guardar_estadisticas(stats, "componentes.csv")
+            self.stats_textbox.configure(state="normal")
+            self.stats_textbox.delete("1.0", "end")
+            self.stats_textbox.insert(
+                "end",
+                "".join(
+                    f"{stats['label'][k]}: {stats['voxels'][k]} vóx, "
+                    f"{stats['volume_mm3'][k]:.1f} mm³, "
+                    f"media {stats['mean_intensity'][k]:.1f}\n"
+                    for k in range(count)
+                ),
+            )
+            self.stats_textbox.configure(state="disabled")
+
+            self.components_label.configure(text=f"Componentes: {count}")
+            self.modified_data = labels
+            self.update_image()
+
+        def conservar_mayor(*args):
+            labels, count = etiquetar_componentes(self.modified_data > 0, connectivity())
+            self.modified_data = conservar_mayor_componente(labels, count).astype(
+                numpy.uint8
+            )
+            self.components_label.configure(text="Componentes: 1")
+            self.update_image()
+
+        def eliminar_pequenas(*args):
+            if not self.min_voxels_input.get().isdigit():
+                tkinter.messagebox.showerror(
+                    "Error", "El mínimo de vóxeles debe ser un número entero."
+                )
+                return
+            labels, count = etiquetar_componentes(self.modified_data > 0, connectivity())
+            self.modified_data = eliminar_componentes_pequenas(
+                labels, count, int(self.min_voxels_input.get())
+            ).astype(numpy.uint8)
+            self.update_image()
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="Componentes conexas",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.connectivity_select = customtkinter.CTkOptionMenu(
+            self.threshold_frame, values=["6 vecinos", "26 vecinos"]
+        )
+        self.connectivity_select.grid(row=1, column=0, padx=20, pady=10)
+
+        self.components_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Componentes: ", anchor="w"
+        )
+        self.components_label.grid(row=2, column=0, padx=20, pady=(10, 0))
+
+        self.label_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Etiquetar", command=etiquetar
+        )
+        self.label_button.grid(row=3, column=0, padx=20, pady=(10, 0))
+
+        self.largest_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Conservar la mayor", command=conservar_mayor
+        )
+        self.largest_button.grid(row=4, column=0, padx=20, pady=(10, 0))
+
+        self.min_voxels_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Mínimo de vóxeles:", anchor="w"
+        )
+        self.min_voxels_label.grid(row=5, column=0, padx=20, pady=(10, 0))
+        self.min_voxels_input = customtkinter.CTkEntry(self.threshold_frame)
+        self.min_voxels_input.insert(0, "100")
+        self.min_voxels_input.grid(row=6, column=0, padx=20, pady=(0, 10))
+
+        self.small_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Eliminar pequeñas", command=eliminar_pequenas
+        )
+        self.small_button.grid(row=7, column=0, padx=20, pady=(10, 20))
+
+        self.stats_textbox = customtkinter.CTkTextbox(
+            self.threshold_frame, width=200, height=200, state="disabled"
+        )
+        self.stats_textbox.grid(row=8, column=0, padx=20, pady=(0, 20))
+
+    def morfologia(self):
+        def update_radius_label(*args):
+            self.radius_label.configure(text=f"Radio: {int(self.radius_slider.get())}")
+
+        def aplicar(*args):
+            mask = self.modified_data > 0
+            radius = int(self.radius_slider.get())
+            operation = self.operation_select.get()
+
+            if operation == "Apertura":
+                mask = apertura(mask, radius)
+            elif operation == "Cierre":
+                mask = cierre(mask, radius)
+            elif operation == "Dilatación":
+                mask = dilatar(mask, radius)
+            elif operation == "Erosión":
+                mask = erosionar(mask, radius)
+            else:
+                mask = rellenar_huecos(mask)
+
+            self.modified_data = mask.astype(numpy.uint8)
+            self.update_image()
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="Morfología",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.operation_select = customtkinter.CTkOptionMenu(
+            self.threshold_frame,
+            values=["Apertura", "Cierre", "Rellenar huecos", "Dilatación", "Erosión"],
+        )
+        self.operation_select.grid(row=1, column=0, padx=20, pady=10)
+
+        self.radius_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Radio: 1", anchor="w"
+        )
+        self.radius_label.grid(row=2, column=0, padx=20, pady=(10, 0))
+        self.radius_slider = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=1,
+            to=20,
+            number_of_steps=19,
+            command=update_radius_label,
+        )
+        self.radius_slider.set(1)
+        self.radius_slider.grid(row=3, column=0, padx=20, pady=(10, 0))
+
+        self.morphology_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Aplicar", command=aplicar
+        )
+        self.morphology_button.grid(row=4, column=0, padx=20, pady=(10, 20))
+
+    def random_walker(self):
+        def update_beta_label(*args):
+            self.beta_label.configure(text=f"Beta: {int(self.beta_slider.get())}")
+
+        def segmentar(*args):
+            shape = self.data.shape
+            foreground_color = self.colors[0][
+                self.colors[1].index(self.foreground_select.get())
+            ]
+            background_color = self.colors[0][
+                self.colors[1].index(self.background_select.get())
+            ]
+            foreground = semillas_trazos(self.drawn_objects_dict, shape, foreground_color)
+            background = semillas_trazos(self.drawn_objects_dict, shape, background_color)
+            if len(foreground) == 0 or len(background) == 0:
+                tkinter.messagebox.showerror(
+                    "Error", "Se necesitan semillas de foreground y de background."
+                )
+                return
+
+            try:
+                probability = random_walker(
+                    self.data, foreground, background, beta=self.beta_slider.get()
+                )
+            except RuntimeError as error:
+                tkinter.messagebox.showerror("Error", str(error))
+                return
+
+            self.modified_data = (probability > 0.5).astype(numpy.uint8)
+            self.update_image()
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="Random walker 3D",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.foreground_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Color foreground:", anchor="w"
+        )
+        self.foreground_label.grid(row=1, column=0, padx=20, pady=(10, 0))
+        self.foreground_select = customtkinter.CTkOptionMenu(
+            self.threshold_frame, values=self.colors[1]
+        )
+        self.foreground_select.set(self.colors[1][0])
+        self.foreground_select.grid(row=2, column=0, padx=20, pady=10)
+
+        self.background_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Color background:", anchor="w"
+        )
+        self.background_label.grid(row=3, column=0, padx=20, pady=(10, 0))
+        self.background_select = customtkinter.CTkOptionMenu(
+            self.threshold_frame, values=self.colors[1]
+        )
+        self.background_select.set(self.colors[1][1])
+        self.background_select.grid(row=4, column=0, padx=20, pady=10)
+
+        self.beta_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Beta: 90", anchor="w"
+        )
+        self.beta_label.grid(row=5, column=0, padx=20, pady=(10, 0))
+        self.beta_slider = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=10,
+            to=500,
+            number_of_steps=49,
+            command=update_beta_label,
+        )
+        self.beta_slider.set(90)
+        self.beta_slider.grid(row=6, column=0, padx=20, pady=(10, 0))
+
+        self.random_walker_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Segmentar", command=segmentar
+        )
+        self.random_walker_button.grid(row=7, column=0, padx=20, pady=(10, 20))
+
+    def chan_vese(self):
+        def update_iterations_label(*args):
+            self.iterations_label.configure(
+                text=f"Iteraciones: {int(self.iterations_input.get())}"
+            )
+
+        def update_mu_label(*args):
+            self.mu_label.configure(text=f"Mu: {self.mu_slider.get():.2f}")
+
+        def segmentar(*args):
+            initial_mask = self.modified_data > 0
+            if not initial_mask.any() or initial_mask.all():
+                tkinter.messagebox.showerror(
+                    "Error",
+                    "Primero umbralice o aplique crecimiento de regiones para "
+                    "inicializar el contorno.",
+                )
+                return
+
+            self.modified_data = chan_vese(
+                self.data,
+                initial_mask,
+                iterations=int(self.iterations_input.get()),
+                mu=self.mu_slider.get(),
+            )
+            self.update_image()
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="Chan-Vese",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.iterations_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Iteraciones: 200", anchor="w"
+        )
+        self.iterations_label.grid(row=1, column=0, padx=20, pady=(10, 0))
+        self.iterations_input = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=10,
+            to=1000,
+            number_of_steps=99,
+            command=update_iterations_label,
+        )
+        self.iterations_input.set(200)
+        self.iterations_input.grid(row=2, column=0, padx=20, pady=(10, 0))
+
+        self.mu_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Mu: 0.20", anchor="w"
+        )
+        self.mu_label.grid(row=3, column=0, padx=20, pady=(10, 0))
+        self.mu_slider = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=0,
+            to=1,
+            number_of_steps=20,
+            command=update_mu_label,
+        )
+        self.mu_slider.set(0.2)
+        self.mu_slider.grid(row=4, column=0, padx=20, pady=(10, 0))
+
+        self.chan_vese_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Segmentar", command=segmentar
+        )
+        self.chan_vese_button.grid(row=5, column=0, padx=20, pady=(10, 20))
+
+    def watershed(self):
+        def update_levels_label(*args):
+            self.levels_label.configure(
+                text=f"Niveles: {int(self.levels_slider.get())}"
+            )
+
+        def segmentar(*args):
+            shape = self.data.shape
+            markers = numpy.zeros(shape, dtype=numpy.int32)
+            for label, color in enumerate(self.colors[0], start=1):
+                markers.flat[semillas_trazos(self.drawn_objects_dict, shape, color)] = label
+            if len(numpy.unique(markers)) < 3:
+                tkinter.messagebox.showerror(
+                    "Error", "Se necesitan marcadores de al menos dos colores."
+                )
+                return
+
+            gradient = magnitud_gradiente(self.data, axes=(0, 1, 2))
+            self.modified_data = watershed_marcadores(
+                gradient, markers, levels=int(self.levels_slider.get())
+            ).astype(numpy.uint8)
+            self.update_image()
+
+        self.no_threshold()
+        self.threshold_frame = customtkinter.CTkFrame(self, width=140, corner_radius=0)
+        self.threshold_frame.grid(row=0, column=0, rowspan=6, sticky="nsew")
+
+        self.titulo_label = customtkinter.CTkLabel(
+            self.threshold_frame,
+            text="Watershed",
+            font=customtkinter.CTkFont(size=20, weight="bold"),
+        )
+        self.titulo_label.grid(row=0, column=0, padx=20, pady=(20, 10))
+
+        self.levels_label = customtkinter.CTkLabel(
+            self.threshold_frame, text="Niveles: 256", anchor="w"
+        )
+        self.levels_label.grid(row=1, column=0, padx=20, pady=(10, 0))
+        self.levels_slider = customtkinter.CTkSlider(
+            self.threshold_frame,
+            from_=16,
+            to=1024,
+            number_of_steps=63,
+            command=update_levels_label,
+        )
+        self.levels_slider.set(256)
+        self.levels_slider.grid(row=2, column=0, padx=20, pady=(10, 0))
+
+        self.watershed_button = customtkinter.CTkButton(
+            self.threshold_frame, text="Segmentar", command=segmentar
+        )
+        self.watershed_button.grid(row=3, column=0, padx=20, pady=(10, 20))
+
 
 def main():
     app = GUI()
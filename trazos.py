@@ -0,0 +1,124 @@
+import numpy as np
+import matplotlib.colors
+
+
+class Trazos:
+    # Semillas dibujadas sobre un eje: arreglos de numpy que crecen al doble
+    # cuando se llenan y un único scatter que se repinta con blitting, en
+    # lugar de una línea de matplotlib y un redibujo completo por evento.
+    # Cada semilla recuerda el corte (dimensión, capa) en que se pintó: sólo
+    # las del corte actual se dibujan y se usan en 2D.
+    def __init__(self, ax, capacity=4096, markersize=5):
+        self.filas = np.empty(capacity, dtype=np.int32)
+        self.columnas = np.empty(capacity, dtype=np.int32)
+        self.codigos = np.empty(capacity, dtype=np.uint8)
+        self.indices = np.empty(capacity, dtype=np.int64)
+        self.dimensiones = np.empty(capacity, dtype=np.int8)
+        self.capas = np.empty(capacity, dtype=np.int32)
+        self.count = 0
+        self.corte = (-1, -1)
+        self.paleta = []
+        self.rgba = np.zeros((0, 4))
+        self.posiciones = {}
+        self.markersize = markersize
+        self.background = None
+        self.ax = None
+        self.draw_cid = None
+        self.adjuntar(ax)
+
+    def adjuntar(self, ax):
+        # ax.clear() elimina el scatter: hay que volver a crearlo después.
+        if self.ax is not None:
+            self.ax.figure.canvas.mpl_disconnect(self.draw_cid)
+        self.ax = ax
+        self.artist = ax.scatter(
+            [], [], s=self.markersize**2, marker="o", animated=True, zorder=3
+        )
+        self.background = None
+        self.draw_cid = ax.figure.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def __len__(self):
+        return self.count
+
+    def codigo(self, color):
+        return self.paleta.index(color) if color in self.paleta else -1
+
+    def agregar(self, fila, columna, color, indice=-1, corte=(-1, -1)):
+        if color not in self.paleta:
+            self.paleta.append(color)
+            self.rgba = matplotlib.colors.to_rgba_array(self.paleta)
+        codigo = self.paleta.index(color)
+
+        # Un punto repetido no agrega semillas; si cambió de color, gana el
+        # último trazo.
+        key = (corte, fila, columna)
+        position = self.posiciones.get(key)
+        if position is not None:
+            self.codigos[position] = codigo
+            return
+
+        if self.count == len(self.filas):
+            capacity = 2 * len(self.filas)
+            self.filas = np.resize(self.filas, capacity)
+            self.columnas = np.resize(self.columnas, capacity)
+            self.codigos = np.resize(self.codigos, capacity)
+            self.indices = np.resize(self.indices, capacity)
+            self.dimensiones = np.resize(self.dimensiones, capacity)
+            self.capas = np.resize(self.capas, capacity)
+
+        self.filas[self.count] = fila
+        self.columnas[self.count] = columna
+        self.codigos[self.count] = codigo
+        self.indices[self.count] = indice
+        self.dimensiones[self.count], self.capas[self.count] = corte
+        self.posiciones[key] = self.count
+        self.count += 1
+
+    def visibles(self):
+        n = self.count
+        dimension, capa = self.corte
+        return (self.dimensiones[:n] == dimension) & (self.capas[:n] == capa)
+
+    def semillas(self):
+        # Semillas del corte actual, en coordenadas de la imagen mostrada.
+        visibles = self.visibles()
+        n = self.count
+        return (
+            self.filas[:n][visibles],
+            self.columnas[:n][visibles],
+            self.codigos[:n][visibles],
+        )
+
+    def semillas_volumen(self):
+        n = self.count
+        valid = self.indices[:n] >= 0
+        return self.indices[:n][valid], self.codigos[:n][valid]
+
+    def limpiar(self):
+        self.count = 0
+        self.paleta = []
+        self.rgba = np.zeros((0, 4))
+        self.posiciones = {}
+        self.dibujar()
+
+    def on_draw(self, event):
+        # Tras un redibujo completo se guarda el fondo sin las semillas y se
+        # pintan encima.
+        canvas = self.ax.figure.canvas
+        self.background = canvas.copy_from_bbox(self.ax.bbox)
+        self.pintar()
+
+    def pintar(self):
+        filas, columnas, codigos = self.semillas()
+        self.artist.set_offsets(np.column_stack([columnas, filas]))
+        self.artist.set_color(self.rgba[codigos])
+        self.ax.draw_artist(self.artist)
+
+    def dibujar(self):
+        canvas = self.ax.figure.canvas
+        if self.background is None:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        self.pintar()
+        canvas.blit(self.ax.bbox)